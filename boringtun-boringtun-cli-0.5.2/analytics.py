@@ -0,0 +1,173 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Aggregate object statistics across many container DBs.
+
+Run with ``python -m swift.container.analytics --help``. NumPy must be
+installed.
+"""
+
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import sys
+
+from swift.container.backend import ContainerBroker
+
+#: Number of size histogram buckets; bucket ``i`` counts objects with sizes
+#: in ``[2 ** (i - 1), 2 ** i)``, and bucket 0 counts empty objects.
+SIZE_BUCKETS = 64
+
+
+def find_db_files(path):
+    """
+    Yields the paths of all ``.db`` files found below the given directory.
+    """
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith(".db"):
+                yield os.path.join(root, filename)
+
+
+def empty_summary():
+    return {
+        "dbs": 0,
+        "errors": 0,
+        "object_count": 0,
+        "bytes_used": 0,
+        "size_histogram": [0] * SIZE_BUCKETS,
+        "content_types": {},
+        "policies": {},
+    }
+
+
+def summarize_db(db_path, batch_size=100000):
+    """
+    Summarize the undeleted objects in a single container DB.
+
+    :param db_path: path to a container DB file
+    :param batch_size: number of rows read into each columnar batch
+    :return: a summary dict, as returned by :func:`empty_summary`
+    """
+    import numpy
+
+    summary = empty_summary()
+    summary["dbs"] = 1
+    broker = ContainerBroker(db_path, skip_commits=True)
+    try:
+        for batch in broker.export_object_columns(batch_size=batch_size):
+            sizes = batch["size"]
+            summary["object_count"] += len(sizes)
+            summary["bytes_used"] += int(sizes.sum())
+
+            buckets = numpy.zeros(len(sizes), dtype=numpy.int64)
+            positive = sizes > 0
+            buckets[positive] = numpy.frexp(sizes[positive])[1]
+            histogram = numpy.bincount(buckets, minlength=SIZE_BUCKETS)
+            for i, count in enumerate(histogram[:SIZE_BUCKETS]):
+                summary["size_histogram"][i] += int(count)
+
+            codes = batch["content_type"]
+            counts = numpy.bincount(codes)
+            totals = numpy.bincount(codes, weights=sizes)
+            for i, content_type in enumerate(batch["content_types"]):
+                stats = summary["content_types"].setdefault(
+                    str(content_type), {"object_count": 0, "bytes_used": 0}
+                )
+                stats["object_count"] += int(counts[i])
+                stats["bytes_used"] += int(totals[i])
+
+            policies = batch["storage_policy_index"]
+            for policy_index in numpy.unique(policies):
+                in_policy = policies == policy_index
+                stats = summary["policies"].setdefault(
+                    str(policy_index), {"object_count": 0, "bytes_used": 0}
+                )
+                stats["object_count"] += int(in_policy.sum())
+                stats["bytes_used"] += int(sizes[in_policy].sum())
+    except Exception as err:
+        sys.stderr.write("Failed to summarize %s: %s\n" % (db_path, err))
+        summary = empty_summary()
+        summary["errors"] = 1
+    return summary
+
+
+def merge_summaries(summary, other):
+    """
+    Add the counts of one summary to another.
+
+    :param summary: the summary dict to update
+    :param other: the summary dict to add to ``summary``
+    :return: ``summary``
+    """
+    for key in ("dbs", "errors", "object_count", "bytes_used"):
+        summary[key] += other[key]
+    for i, count in enumerate(other["size_histogram"]):
+        summary["size_histogram"][i] += count
+    for key in ("content_types", "policies"):
+        for name, stats in other[key].items():
+            totals = summary[key].setdefault(name, {"object_count": 0, "bytes_used": 0})
+            totals["object_count"] += stats["object_count"]
+            totals["bytes_used"] += stats["bytes_used"]
+    return summary
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Aggregate object size histograms, content-type breakdowns "
+        "and per-policy totals across all container DBs below a directory; "
+        "the summary is written to stdout as JSON."
+    )
+    parser.add_argument("path", help="directory to search for .db files")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="number of worker processes",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100000,
+        help="number of rows read from a DB in each batch",
+    )
+    args = parser.parse_args(args)
+
+    summary = empty_summary()
+    db_paths = find_db_files(args.path)
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers)
+        try:
+            summaries = pool.imap_unordered(
+                functools.partial(summarize_db, batch_size=args.batch_size), db_paths
+            )
+            for db_summary in summaries:
+                merge_summaries(summary, db_summary)
+        finally:
+            pool.terminate()
+    else:
+        for db_path in db_paths:
+            merge_summaries(summary, summarize_db(db_path, args.batch_size))
+    json.dump(summary, sys.stdout, sort_keys=True, indent=2)
+    sys.stdout.write("\n")
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,9 +8,15 @@
 Pluggable Back-ends for Container Server
 """
 
+import collections
 import errno
 
+import heapq
+import itertools
+import json
 import os
+import time
+from contextlib import contextmanager
 from uuid import uuid4
 
 import six
@@ -40,6 +46,9 @@ from swift.common.utils import (
     filter_shard_ranges,
     ShardRangeList,
 )
+from swift.container import timestamps
+from swift.container.executors import in_tpool_thread
+from swift.container.name_filter import NameFilter
 from swift.common.db import (
     DatabaseBroker,
     utf8encode,
@@ -47,6 +56,7 @@ from swift.common.db import (
     zero_like,
     DatabaseAlreadyExists,
     SQLITE_ARG_LIMIT,
+    native_str_keys_and_values,
 )
 
 DATADIR = "containers"
@@ -61,6 +71,69 @@ SHARDING = "sharding"
 SHARDED = "sharded"
 COLLAPSED = "collapsed"
 
+#: The most rows that a reverse listing with a delimiter will walk past within
+#: a subdir before it re-queries below the subdir instead.
+REVERSE_LISTING_SKIP_ROWS = 16
+
+#: The sqlite pragmas that a tuning profile may set, each mapped to the values
+#: it may take, or to ``int`` if it takes an integer. These only apply to the
+#: connection; journal_mode is not among them because it is stored in the db
+#: file, where it would affect every other daemon, and in WAL mode commits in
+#: the -wal file are left behind when replication copies the db file.
+TUNING_PRAGMAS = {
+    "cache_size": int,
+    "mmap_size": int,
+    "synchronous": ("OFF", "NORMAL", "FULL"),
+    "temp_store": ("DEFAULT", "FILE", "MEMORY"),
+}
+
+#: Default pragmas of each tuning profile; these add to the pragmas set by
+#: :func:`swift.common.db.get_db_connection`. Negative cache sizes are in KiB.
+DEFAULT_TUNING_PROFILES = {
+    # sqlite's defaults suit small dbs
+    "tiny": {},
+    "hot": {"cache_size": -16384, "mmap_size": 64 * 1024 * 1024},
+    "huge": {"cache_size": -65536, "mmap_size": 1024 * 1024 * 1024},
+    # a retiring db is only read while it is cleaved, so map it rather than
+    # filling the page cache with it
+    "retiring": {"cache_size": -8192, "mmap_size": 1024 * 1024 * 1024},
+}
+
+#: By default, dbs with fewer object rows than this have no name filter.
+NAME_FILTER_MIN_ROWS = 10000
+
+#: The most rows whose names are added to a name filter by one merge_items
+#: call while the filter is being built.
+NAME_FILTER_BUILD_ROWS = 50000
+
+#: The least number of seconds between writes of a name filter to disk.
+NAME_FILTER_SAVE_INTERVAL = 300
+
+#: By default, dbs with more object rows than this have no name filter; a
+#: filter takes about 2.5 bytes per row.
+NAME_FILTER_MAX_ROWS = 10000000
+
+#: By default, the most bytes of name filters cached in memory.
+NAME_FILTER_CACHE_BYTES = 256 * 1024 * 1024
+
+#: By default, the aggregates of prefixes with at most this many delimiters are
+#: cached; see :meth:`ContainerBroker.get_prefix_stats`.
+PREFIX_STATS_CACHE_DEPTH = 2
+
+#: The most prefix aggregates cached in memory.
+PREFIX_STATS_CACHE_SIZE = 10000
+
+#: maps (db file path, prefix, policy index) -> (db version, aggregates),
+#: least recently used first
+_prefix_stats = collections.OrderedDict()
+
+#: By default, dbs with fewer object rows than this use the ``tiny`` tuning
+#: profile.
+TUNING_TINY_MAX_ROWS = 10000
+
+#: By default, dbs with at least this many object rows use the ``huge`` tuning
+#: profile.
+TUNING_HUGE_MIN_ROWS = 1000000
 
 SHARD_STATS_STATES = [ShardRange.ACTIVE, ShardRange.SHARDING, ShardRange.SHRINKING]
 SHARD_LISTING_STATES = SHARD_STATS_STATES + [ShardRange.CLEAVED]
@@ -355,6 +428,121 @@ def merge_shards(shard_data, existing):
     return new_content
 
 
+def parse_tuning_conf(conf):
+    """
+    Returns tuning profiles made of :data:`DEFAULT_TUNING_PROFILES` updated
+    with any ``db_tuning_<profile>_<pragma>`` options in the given conf, e.g.
+    ``db_tuning_huge_mmap_size = 4294967296``.
+
+    :param conf: a config dict
+    :returns: a dict mapping profile names to dicts of pragmas
+    :raises ValueError: if an option names an unknown profile or pragma or
+        has an invalid value
+    """
+    profiles = dict(
+        (name, dict(pragmas)) for name, pragmas in DEFAULT_TUNING_PROFILES.items()
+    )
+    for key, value in conf.items():
+        if not key.startswith("db_tuning_"):
+            continue
+        name, _sep, pragma = key[len("db_tuning_") :].partition("_")
+        if name not in profiles or pragma not in TUNING_PRAGMAS:
+            raise ValueError("Unknown db tuning option %s" % key)
+        allowed = TUNING_PRAGMAS[pragma]
+        if allowed is int:
+            profiles[name][pragma] = int(value)
+        elif str(value).upper() in allowed:
+            profiles[name][pragma] = str(value).upper()
+        else:
+            raise ValueError(
+                "Invalid value %r for %s; expected one of %s"
+                % (value, key, ", ".join(allowed))
+            )
+    return profiles
+
+
+class _ListingCursor(object):
+    """
+    Reads object rows, deleted or not, from one component db of a merged
+    listing, a page at a time and only when they are needed.
+
+    :param broker: the component db's broker
+    :param lower: names must be greater than this, or None
+    :param lower_inclusive: if True, names may also be equal to ``lower``
+    :param upper: names must be less than this, or None
+    :param reverse: if True, rows are read in descending name order
+    :param storage_policy_index: the storage policy index of the rows
+    :param allow_reserved: if True, include names with the reserved byte
+    :param stats: a dict whose ``rows_read`` count is updated
+    """
+
+    def __init__(
+        self,
+        broker,
+        lower,
+        lower_inclusive,
+        upper,
+        reverse,
+        storage_policy_index,
+        allow_reserved,
+        stats,
+    ):
+        self.broker = broker
+        self.lower = lower
+        self.lower_inclusive = lower_inclusive
+        self.upper = upper
+        self.reverse = reverse
+        self.storage_policy_index = storage_policy_index
+        self.allow_reserved = allow_reserved
+        self.stats = stats
+        self.rows = collections.deque()
+        self.exhausted = False
+
+    def peek(self, wanted):
+        """
+        Returns the next row, or None if there are no more rows.
+
+        :param wanted: the number of rows to read if a page must be read
+        """
+        if not self.rows and not self.exhausted:
+            rows = self.broker._get_object_rows(
+                wanted,
+                self.lower,
+                self.lower_inclusive,
+                self.upper,
+                self.reverse,
+                self.storage_policy_index,
+                self.allow_reserved,
+            )
+            self.stats["rows_read"] += len(rows)
+            self.exhausted = len(rows) < wanted
+            if rows and self.reverse:
+                self.upper = rows[-1][0]
+            elif rows:
+                self.lower, self.lower_inclusive = rows[-1][0], False
+            self.rows.extend(rows)
+        return self.rows[0] if self.rows else None
+
+    def pop(self):
+        return self.rows.popleft()
+
+    def seek(self, bound):
+        """
+        Skip rows whose names are less than ``bound``, or, if reading in
+        reverse, are greater than or equal to ``bound``.
+        """
+        if self.reverse:
+            while self.rows and self.rows[0][0] >= bound:
+                self.rows.popleft()
+            if not self.rows and (self.upper is None or bound < self.upper):
+                self.upper = bound
+        else:
+            while self.rows and self.rows[0][0] < bound:
+                self.rows.popleft()
+            if not self.rows and (self.lower is None or bound > self.lower):
+                self.lower, self.lower_inclusive = bound, True
+
+
 class ContainerBroker(DatabaseBroker):
     """
     Encapsulates working with a container database.
@@ -397,6 +585,15 @@ class ContainerBroker(DatabaseBroker):
         stale_reads_ok=False,
         skip_commits=False,
         force_db_file=False,
+        drive_executors=None,
+        tuning_profiles=None,
+        tuning_tiny_max_rows=TUNING_TINY_MAX_ROWS,
+        tuning_huge_min_rows=TUNING_HUGE_MIN_ROWS,
+        name_filters=None,
+        name_filter_min_rows=NAME_FILTER_MIN_ROWS,
+        name_filter_max_rows=NAME_FILTER_MAX_ROWS,
+        prefix_stats_cache_depth=PREFIX_STATS_CACHE_DEPTH,
+        query_stats=False,
     ):
         self._init_db_file = db_file
         if db_file == ":memory:":
@@ -417,6 +614,41 @@ class ContainerBroker(DatabaseBroker):
         self._root_account = self._root_container = None
         self._force_db_file = force_db_file
         self._db_files = None
+        # table columns are probed on demand and cached per connection
+        self._schema_conn = None
+        self._schema_columns = {}
+        self._raw_metadata = None
+        self._parsed_metadata = {}
+        #: if set, maps profile names to the pragmas applied to each new
+        #: connection; see :meth:`get_tuning_profile`
+        self.tuning_profiles = tuning_profiles
+        self.tuning_tiny_max_rows = tuning_tiny_max_rows
+        self.tuning_huge_min_rows = tuning_huge_min_rows
+        #: if set, a :class:`~swift.container.name_filter.NameFilterCache` in
+        #: which merge_items keeps a Bloom filter of the db's object names, to
+        #: skip the existing row lookup for names that are definitely new
+        self.name_filters = name_filters
+        self.name_filter_min_rows = name_filter_min_rows
+        self.name_filter_max_rows = name_filter_max_rows
+        #: the aggregates of prefixes with at most this many delimiters are
+        #: cached; see :meth:`get_prefix_stats`
+        self.prefix_stats_cache_depth = prefix_stats_cache_depth
+        #: if True, the broker emits per-operation statsd metrics through its
+        #: logger; see :meth:`_op_stats`
+        self.query_stats = query_stats
+        #: the result of the last call to :meth:`get_info`, if any
+        self.last_info = None
+        #: the connection to which :attr:`tuning_profiles` were last applied
+        self._tuned_conn = None
+        #: the name of the tuning profile applied to the current connection
+        self.tuning_profile = None
+        #: if set, an object whose ``phase(name)`` method returns a context
+        #: manager in which each broker operation is run, for timing requests
+        self.phase_timer = None
+        #: if set, a :class:`~swift.container.executors.DriveExecutors` that
+        #: limits each drive's use of eventlet's thread pool; see
+        #: :meth:`tpool_execute`
+        self.drive_executors = drive_executors
 
     @classmethod
     def create_broker(
@@ -460,6 +692,65 @@ class ContainerBroker(DatabaseBroker):
                 pass
         return broker
 
+    @contextmanager
+    def _op_stats(self, op):
+        """
+        Context manager that measures a broker operation.
+
+        If the broker has a :attr:`phase_timer` then the operation is timed as
+        a phase named ``op``.
+
+        The yielded dict may be updated by the operation with counts of the
+        ``rows_read`` (fetched from the db) and ``rows_written`` and with
+        ``lock_wait`` and ``tpool_wait`` times, in seconds. If
+        :attr:`query_stats` is True then, when the operation completes or
+        fails, the following metrics are emitted:
+
+          * ``broker.<op>.timing``: total duration
+          * ``broker.<op>.lock_wait.timing``: time waiting for locks
+          * ``broker.<op>.tpool_wait.timing``: time queued for a tpool thread
+          * ``broker.<op>.execute.timing``: total less the above waits
+          * ``broker.<op>.rows_read`` and ``broker.<op>.rows_written``
+          * ``broker.<op>.errors``: incremented if the operation failed
+
+        :param op: the name of the operation
+        """
+        stats = {
+            "rows_read": 0,
+            "rows_written": 0,
+            "lock_wait": 0.0,
+            "tpool_wait": 0.0,
+        }
+        start = time.time()
+        failed = True
+        try:
+            if self.phase_timer is None:
+                yield stats
+            else:
+                with self.phase_timer.phase(op):
+                    yield stats
+            failed = False
+        finally:
+            if self.query_stats:
+                self._emit_op_stats(op, stats, time.time() - start, failed)
+
+    def _emit_op_stats(self, op, stats, elapsed, failed):
+        """
+        Emit the metrics of an operation measured by :meth:`_op_stats`.
+        """
+        waited = stats["lock_wait"] + stats["tpool_wait"]
+        metric = "broker.%s." % op
+        if failed:
+            self.logger.increment(metric + "errors")
+        self.logger.timing(metric + "timing", elapsed * 1000)
+        self.logger.timing(metric + "lock_wait.timing", stats["lock_wait"] * 1000)
+        self.logger.timing(metric + "tpool_wait.timing", stats["tpool_wait"] * 1000)
+        self.logger.timing(metric + "execute.timing", max(elapsed - waited, 0) * 1000)
+        if stats["rows_read"]:
+            self.logger.update_stats(metric + "rows_read", stats["rows_read"])
+        if stats["rows_written"]:
+            self.logger.update_stats(metric + "rows_written", stats["rows_written"])
+
     def get_db_state(self):
         """
         Returns the current state of on disk db files.
@@ -516,6 +807,7 @@ class ContainerBroker(DatabaseBroker):
             return
         # reset connection so the next access will use the correct DB file
         self.conn = None
+        self._schema_columns = {}
         self._db_files = get_db_files(self._init_db_file)
 
     @property
@@ -551,6 +843,48 @@ class ContainerBroker(DatabaseBroker):
             return self.db_files[-1]
         return self._init_db_file
 
+    @contextmanager
+    def get(self):
+        """
+        Use with the "with" statement; returns a database connection. If
+        :attr:`tuning_profiles` is set then a tuning profile is applied to
+        each new connection.
+        """
+        with super(ContainerBroker, self).get() as conn:
+            if self.tuning_profiles and conn is not self._tuned_conn:
+                self._tune_connection(conn)
+            yield conn
+
+    def get_tuning_profile(self, object_rows):
+        """
+        Returns the name of the tuning profile for this broker's db.
+
+        :param object_rows: an estimate of the number of rows in the object
+            table
+        """
+        db_files = self.db_files
+        if db_files and len(db_files) > 1 and self.db_file != db_files[-1]:
+            return "retiring"
+        if object_rows < self.tuning_tiny_max_rows:
+            return "tiny"
+        if object_rows >= self.tuning_huge_min_rows:
+            return "huge"
+        return "hot"
+
+    def _tune_connection(self, conn):
+        try:
+            # the largest ROWID is a cheap estimate of the table's size
+            object_rows = conn.execute("SELECT MAX(ROWID) FROM object").fetchone()[0]
+        except sqlite3.OperationalError as err:
+            if "no such table" not in str(err):
+                raise
+            object_rows = 0
+        profile = self.get_tuning_profile(object_rows or 0)
+        for pragma, value in sorted(self.tuning_profiles.get(profile, {}).items()):
+            conn.execute("PRAGMA %s = %s" % (pragma, value)).fetchall()
+        self._tuned_conn = conn
+        self.tuning_profile = profile
+
     @property
     def db_epoch(self):
         hash_, epoch, ext = parse_db_filename(self.db_file)
@@ -567,6 +901,28 @@ class ContainerBroker(DatabaseBroker):
         self._populate_instance_cache()
         return "%s/%s" % (self.account, self.container)
 
+    @property
+    def metadata(self):
+        """
+        Returns the metadata dict for the database, as described for
+        :attr:`~swift.common.db.DatabaseBroker.metadata`.
+
+        The raw metadata is read from the db on every access, but it is only
+        parsed when it differs from the raw metadata that was last parsed by
+        this broker.
+        """
+        raw_metadata = self.get_raw_metadata()
+        if raw_metadata != self._raw_metadata:
+            if raw_metadata:
+                metadata = json.loads(raw_metadata)
+                native_str_keys_and_values(metadata)
+            else:
+                metadata = {}
+            self._raw_metadata, self._parsed_metadata = raw_metadata, metadata
+        # copy the [value, timestamp] lists too, so that callers that modify
+        # them do not change the parsed metadata
+        return dict((key, list(value)) for key, value in self._parsed_metadata.items())
+
     def _initialize(self, conn, put_timestamp, storage_policy_index):
         """
         Create a brand new container database (tables, indices, triggers, etc.)
@@ -584,6 +940,7 @@ class ContainerBroker(DatabaseBroker):
         self.create_container_info_table(conn, put_timestamp, storage_policy_index)
         self.create_shard_range_table(conn)
         self._db_files = None
+        self._schema_columns = {}
 
     def create_object_table(self, conn):
         """
@@ -719,6 +1076,58 @@ class ContainerBroker(DatabaseBroker):
         """
             % SHARD_RANGE_TABLE
         )
+        self._schema_columns.pop(SHARD_RANGE_TABLE, None)
+
+    def _get_columns(self, conn, table):
+        """
+        Returns the set of column names of the given table (or view), or an
+        empty set if it does not exist in the db.
+
+        Each table is probed at most once for as long as the broker keeps
+        using the same connection, so that queries can be built to suit the
+        schema of legacy dbs without first having to fail.
+
+        :param conn: DB connection object
+        :param table: the name of a table or view
+        :return: a frozenset of column names
+        """
+        if conn is not self._schema_conn:
+            self._schema_conn = conn
+            self._schema_columns = {}
+        if table not in self._schema_columns:
+            curs = conn.execute("PRAGMA table_info(%s)" % table)
+            curs.row_factory = None
+            self._schema_columns[table] = frozenset(row[1] for row in curs)
+        return self._schema_columns[table]
+
+    def _has_table(self, conn, table):
+        return bool(self._get_columns(conn, table))
+
+    def _migrate_once(self, conn, migrate, is_migrated):
+        """
+        Migrate the db's schema, then forget the cached schema.
+
+        The schema probed by :meth:`_get_columns` is stale if another process
+        has migrated the db since, in which case the migration fails. The
+        cached schema is then forgotten and the db probed again, and the
+        failure is ignored if the db turns out to be migrated already.
+
+        :param conn: DB connection object
+        :param migrate: a function that migrates the db
+        :param is_migrated: a function that returns True if the db has been
+            migrated
+        """
+        try:
+            migrate()
+        except sqlite3.OperationalError:
+            self._schema_columns = {}
+            if not is_migrated():
+                raise
+            conn.rollback()
+        self._schema_columns = {}
+
+    def _has_column(self, conn, table, column):
+        return column in self._get_columns(conn, table)
 
     def get_db_version(self, conn):
         if self._db_version == -1:
@@ -770,22 +1179,32 @@ class ContainerBroker(DatabaseBroker):
             }
         )
 
+    def _commit_puts_stale_ok(self):
+        """
+        See :func:`swift.common.db.DatabaseBroker._commit_puts_stale_ok`;
+        the commit is measured by :meth:`_op_stats`.
+        """
+        if self._skip_commit_puts():
+            return
+        with self._op_stats("commit_puts"):
+            super(ContainerBroker, self)._commit_puts_stale_ok()
+
+    def commit_pending(self):
+        """
+        Commit any pending updates to the db, as reads of the db do before
+        they query it. A read that is to be run in a thread should be
+        preceded by this, so that the commit is done in the calling thread.
+        """
+        self._commit_puts_stale_ok()
+
     def _empty(self):
         self._commit_puts_stale_ok()
         with self.get() as conn:
-            try:
+            if self._has_table(conn, "policy_stat"):
                 row = conn.execute(
                     "SELECT max(object_count) from policy_stat"
                 ).fetchone()
-            except sqlite3.OperationalError as err:
-                if not any(
-                    msg in str(err)
-                    for msg in (
-                        "no such column: storage_policy_index",
-                        "no such table: policy_stat",
-                    )
-                ):
-                    raise
+            else:
                 row = conn.execute("SELECT object_count from container_stat").fetchone()
             return zero_like(row[0])
 
@@ -927,7 +1346,7 @@ class ContainerBroker(DatabaseBroker):
         # value is greater than the put_timestamp, and there are no
         # objects in the container.
         return zero_like(object_count) and (
-            Timestamp(delete_timestamp) > Timestamp(put_timestamp)
+            timestamps.is_newer(delete_timestamp, put_timestamp)
         )
 
     def _is_deleted(self, conn):
@@ -996,40 +1415,31 @@ class ContainerBroker(DatabaseBroker):
         return info
 
     def _do_get_info_query(self, conn):
-        data = None
-        trailing_sync = "x_container_sync_point1, x_container_sync_point2"
-        trailing_pol = "storage_policy_index"
-        errors = set()
-        while not data:
-            try:
-                data = conn.execute(
-                    (
-                        """
-                    SELECT account, container, created_at, put_timestamp,
-                        delete_timestamp, status_changed_at,
-                        object_count, bytes_used,
-                        reported_put_timestamp, reported_delete_timestamp,
-                        reported_object_count, reported_bytes_used, hash,
-                        id, %s, %s
-                        FROM container_stat
+        columns = self._get_columns(conn, "container_stat")
+        if "x_container_sync_point1" in columns:
+            trailing_sync = "x_container_sync_point1, x_container_sync_point2"
+        else:
+            trailing_sync = (
+                "-1 AS x_container_sync_point1, -1 AS x_container_sync_point2"
+            )
+        if "storage_policy_index" in columns:
+            trailing_pol = "storage_policy_index"
+        else:
+            trailing_pol = "0 AS storage_policy_index"
+        data = conn.execute(
+            (
                 """
-                    )
-                    % (trailing_sync, trailing_pol)
-                ).fetchone()
-            except sqlite3.OperationalError as err:
-                err_msg = str(err)
-                if err_msg in errors:
-                    # only attempt migration once
-                    raise
-                errors.add(err_msg)
-                if "no such column: storage_policy_index" in err_msg:
-                    trailing_pol = "0 AS storage_policy_index"
-                elif "no such column: x_container_sync_point" in err_msg:
-                    trailing_sync = (
-                        "-1 AS x_container_sync_point1, -1 AS x_container_sync_point2"
-                    )
-                else:
-                    raise
+            SELECT account, container, created_at, put_timestamp,
+                delete_timestamp, status_changed_at,
+                object_count, bytes_used,
+                reported_put_timestamp, reported_delete_timestamp,
+                reported_object_count, reported_bytes_used, hash,
+                id, %s, %s
+                FROM container_stat
+        """
+            )
+            % (trailing_sync, trailing_pol)
+        ).fetchone()
         data = dict(data)
         # populate instance cache
         self._storage_policy_index = data["storage_policy_index"]
@@ -1074,21 +1484,19 @@ class ContainerBroker(DatabaseBroker):
                   x_container_sync_point2, and storage_policy_index,
                   db_state.
         """
-        data = self._get_info()
-        state, stats = self._get_alternate_object_stats()
+        with self._op_stats("get_info"):
+            data = self._get_info()
+            state, stats = self._get_alternate_object_stats()
         data.update(stats)
         data["db_state"] = state
+        self.last_info = data
         return data
 
     def set_x_container_sync_points(self, sync_point1, sync_point2):
         with self.get() as conn:
-            try:
-                self._set_x_container_sync_points(conn, sync_point1, sync_point2)
-            except sqlite3.OperationalError as err:
-                if "no such column: x_container_sync_point" not in str(err):
-                    raise
+            if not self._has_column(conn, "container_stat", "x_container_sync_point1"):
                 self._migrate_add_container_sync_points(conn)
-                self._set_x_container_sync_points(conn, sync_point1, sync_point2)
+            self._set_x_container_sync_points(conn, sync_point1, sync_point2)
             conn.commit()
 
     def _set_x_container_sync_points(self, conn, sync_point1, sync_point2):
@@ -1120,22 +1528,14 @@ class ContainerBroker(DatabaseBroker):
 
     def get_policy_stats(self):
         with self.get() as conn:
-            try:
+            if self._has_table(conn, "policy_stat"):
                 info = conn.execute(
                     """
                     SELECT storage_policy_index, object_count, bytes_used
                     FROM policy_stat
                 """
                 ).fetchall()
-            except sqlite3.OperationalError as err:
-                if not any(
-                    msg in str(err)
-                    for msg in (
-                        "no such column: storage_policy_index",
-                        "no such table: policy_stat",
-                    )
-                ):
-                    raise
+            else:
                 info = conn.execute(
                     """
                     SELECT 0 as storage_policy_index, object_count, bytes_used
@@ -1149,20 +1549,73 @@ class ContainerBroker(DatabaseBroker):
             policy_stats[key] = stats
         return policy_stats
 
+    def get_prefix_stats(self, prefix, delimiter="/", storage_policy_index=0):
+        """
+        Returns the number and total size of the undeleted objects in a policy
+        whose names start with a prefix, counted by one range query of the
+        object table's name index.
+
+        Aggregates of prefixes with at most :attr:`prefix_stats_cache_depth`
+        delimiters, which are the most costly to count and the most often
+        asked for, are cached in memory until the object table changes.
+
+        :param prefix: the prefix of the object names to count
+        :param delimiter: the delimiter by which the depth of the prefix is
+            measured
+        :param storage_policy_index: the policy of the objects to count
+        :returns: a dict with keys ``object_count`` and ``bytes_used``
+        """
+        self._commit_puts_stale_ok()
+        with self._op_stats("get_prefix_stats"), self.get() as conn:
+            # rows are never updated in place and their ROWIDs are never
+            # reused, so the object table is unchanged while its greatest
+            # ROWID and its policy stats are unchanged
+            if self._has_table(conn, "policy_stat"):
+                query = """
+                    SELECT storage_policy_index, object_count, bytes_used
+                    FROM policy_stat ORDER BY storage_policy_index
+                """
+            else:
+                query = """
+                    SELECT 0, object_count, bytes_used FROM container_stat
+                """
+            version = (
+                conn.execute("SELECT MAX(ROWID) FROM object").fetchone()[0],
+                tuple(tuple(row) for row in conn.execute(query)),
+            )
+            key = (self.db_file, prefix, storage_policy_index)
+            cache = prefix.count(delimiter) <= self.prefix_stats_cache_depth
+            cached = _prefix_stats.pop(key, None)
+            if cached and cached[0] == version:
+                _prefix_stats[key] = cached
+                return dict(cached[1])
+            query = "SELECT COUNT(*), SUM(size) FROM object WHERE deleted = 0"
+            args = []
+            if prefix:
+                query += " AND name >= ? AND name < ?"
+                args += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+            if self._has_column(conn, "object", "storage_policy_index"):
+                query += " AND storage_policy_index = ?"
+                args.append(storage_policy_index)
+            object_count, bytes_used = conn.execute(query, args).fetchone()
+        prefix_stats = {"object_count": object_count, "bytes_used": bytes_used or 0}
+        if cache:
+            _prefix_stats[key] = (version, prefix_stats)
+            while len(_prefix_stats) > PREFIX_STATS_CACHE_SIZE:
+                _prefix_stats.popitem(last=False)
+        return dict(prefix_stats)
+
     def has_multiple_policies(self):
         with self.get() as conn:
-            try:
-                curs = conn.execute(
-                    """
-                    SELECT count(storage_policy_index)
-                    FROM policy_stat
-                    """
-                ).fetchone()
-            except sqlite3.OperationalError as err:
-                if "no such table: policy_stat" not in str(err):
-                    raise
+            if not self._has_table(conn, "policy_stat"):
                 # no policy_stat row
                 return False
+            curs = conn.execute(
+                """
+                SELECT count(storage_policy_index)
+                FROM policy_stat
+                """
+            ).fetchone()
             if curs and curs[0] > 1:
                 return True
             # only one policy_stat row
@@ -1195,19 +1648,12 @@ class ContainerBroker(DatabaseBroker):
             conn.commit()
 
         with self.get() as conn:
-            try:
-                _setit(conn)
-            except sqlite3.OperationalError as err:
-                if not any(
-                    msg in str(err)
-                    for msg in (
-                        "no such column: storage_policy_index",
-                        "no such table: policy_stat",
-                    )
-                ):
-                    raise
+            if not (
+                self._has_table(conn, "policy_stat")
+                and self._has_column(conn, "container_stat", "storage_policy_index")
+            ):
                 self._migrate_add_storage_policy(conn)
-                _setit(conn)
+            _setit(conn)
 
         self._storage_policy_index = policy_index
 
@@ -1305,9 +1751,10 @@ class ContainerBroker(DatabaseBroker):
         if prefix:
             end_prefix = prefix[:-1] + chr(ord(prefix[-1]) + 1)
         orig_marker = marker
-        with self.get() as conn:
+        with self._op_stats("list_objects_iter") as stats, self.get() as conn:
             results = []
             deleted_key = self._get_deleted_key(conn)
+            has_policy = self._has_column(conn, "object", "storage_policy_index")
             query_keys = [
                 "name",
                 "created_at",
@@ -1316,6 +1763,66 @@ class ContainerBroker(DatabaseBroker):
                 "etag",
                 deleted_key,
             ]
+            # conditions that follow the name range in every query
+            filter_conditions = []
+            filter_args = []
+            if not allow_reserved:
+                filter_conditions.append("name >= ?")
+                filter_args.append(chr(ord(RESERVED_BYTE) + 1))
+            filter_conditions.append(deleted_key + deleted_arg)
+            if since_row:
+                filter_conditions.append("ROWID > ?")
+                filter_args.append(since_row)
+            # storage policy filter
+            if not has_policy:
+                query_keys.append("0 as storage_policy_index")
+            else:
+                query_keys.append("storage_policy_index")
+                if not all_policies:
+                    filter_conditions.append("storage_policy_index = ?")
+                    filter_args.append(storage_policy_index)
+
+            def build_query(conditions, args, row_limit=None):
+                query = "SELECT " + ", ".join(query_keys) + " FROM object "
+                conditions = conditions + filter_conditions
+                query += "WHERE " + " AND ".join(conditions)
+                query += " ORDER BY name %s" % ("DESC" if reverse else "")
+                if row_limit is None:
+                    return query, tuple(args + filter_args)
+                return query + " LIMIT ?", tuple(args + filter_args + [row_limit])
+
+            if reverse and prefix is not None and delimiter:
+                if end_marker and (not prefix or end_marker < end_prefix):
+                    upper = end_marker
+                elif prefix:
+                    upper = end_prefix
+                else:
+                    upper = None
+                if marker and (not prefix or marker >= prefix):
+                    lower_conditions, lower_args = ["name > ?"], [marker]
+                else:
+                    lower_conditions, lower_args = ["name >= ?"], [prefix]
+
+                def build_reverse_query(upper):
+                    if upper is None:
+                        return build_query(lower_conditions, lower_args)
+                    return build_query(
+                        ["name < ?"] + lower_conditions, [upper] + lower_args
+                    )
+
+                return self._list_objects_reverse(
+                    conn,
+                    build_reverse_query,
+                    upper,
+                    limit,
+                    prefix,
+                    delimiter,
+                    path,
+                    orig_marker,
+                    transform_func,
+                    stats,
+                )
+
             while len(results) < limit:
                 query_args = []
                 query_conditions = []
@@ -1337,54 +1844,20 @@ class ContainerBroker(DatabaseBroker):
                 elif prefix:
                     query_conditions.append("name >= ?")
                     query_args.append(prefix)
-                if not allow_reserved:
-                    query_conditions.append("name >= ?")
-                    query_args.append(chr(ord(RESERVED_BYTE) + 1))
-                query_conditions.append(deleted_key + deleted_arg)
-                if since_row:
-                    query_conditions.append("ROWID > ?")
-                    query_args.append(since_row)
-
-                def build_query(keys, conditions, args):
-                    query = "SELECT " + ", ".join(keys) + " FROM object "
-                    if conditions:
-                        query += "WHERE " + " AND ".join(conditions)
-                    tail_query = """
-                        ORDER BY name %s LIMIT ?
-                    """ % ("DESC" if reverse else "")
-                    return query + tail_query, args + [limit - len(results)]
-
-                # storage policy filter
-                if all_policies:
-                    query, args = build_query(
-                        query_keys + ["storage_policy_index"],
-                        query_conditions,
-                        query_args,
-                    )
-                else:
-                    query, args = build_query(
-                        query_keys + ["storage_policy_index"],
-                        query_conditions + ["storage_policy_index = ?"],
-                        query_args + [storage_policy_index],
-                    )
-                try:
-                    curs = conn.execute(query, tuple(args))
-                except sqlite3.OperationalError as err:
-                    if "no such column: storage_policy_index" not in str(err):
-                        raise
-                    query, args = build_query(
-                        query_keys + ["0 as storage_policy_index"],
-                        query_conditions,
-                        query_args,
-                    )
-                    curs = conn.execute(query, tuple(args))
+
+                query, args = build_query(
+                    query_conditions, query_args, limit - len(results)
+                )
+                curs = conn.execute(query, args)
                 curs.row_factory = None
 
                 # Delimiters without a prefix is ignored, further if there
                 # is no delimiter then we can simply return the result as
                 # prefixes are now handled in the SQL statement.
                 if prefix is None or not delimiter:
-                    return [transform_func(r) for r in curs]
+                    results = [transform_func(r) for r in curs]
+                    stats["rows_read"] += len(results)
+                    return results
 
                 # We have a delimiter and a prefix (possibly empty string) to
                 # handle
@@ -1392,35 +1865,17 @@ class ContainerBroker(DatabaseBroker):
                 for row in curs:
                     rowcount += 1
                     name = row[0]
-                    if reverse:
-                        end_marker = name
-                    else:
-                        marker = name
+                    marker = name
 
                     if len(results) >= limit:
                         curs.close()
+                        stats["rows_read"] += rowcount
                         return results
                     end = name.find(delimiter, len(prefix))
                     if path is not None:
                         if name == path:
                             continue
                         if end >= 0 and len(name) > end + len(delimiter):
-                            if reverse:
-                                end_marker = name[: end + len(delimiter)]
-                            else:
-                                marker = "".join(
-                                    [
-                                        name[:end],
-                                        delimiter[:-1],
-                                        chr(ord(delimiter[-1:]) + 1),
-                                    ]
-                                )
-                            curs.close()
-                            break
-                    elif end >= 0:
-                        if reverse:
-                            end_marker = name[: end + len(delimiter)]
-                        else:
                             marker = "".join(
                                 [
                                     name[:end],
@@ -1428,18 +1883,313 @@ class ContainerBroker(DatabaseBroker):
                                     chr(ord(delimiter[-1:]) + 1),
                                 ]
                             )
-                            # we want result to be inclusive of delim+1
-                            delim_force_gte = True
+                            curs.close()
+                            break
+                    elif end >= 0:
+                        marker = "".join(
+                            [
+                                name[:end],
+                                delimiter[:-1],
+                                chr(ord(delimiter[-1:]) + 1),
+                            ]
+                        )
+                        # we want result to be inclusive of delim+1
+                        delim_force_gte = True
                         dir_name = name[: end + len(delimiter)]
                         if dir_name != orig_marker:
                             results.append([dir_name, "0", 0, None, ""])
                         curs.close()
                         break
                     results.append(transform_func(row))
+                stats["rows_read"] += rowcount
                 if not rowcount:
                     break
             return results
 
+    def _list_objects_reverse(
+        self,
+        conn,
+        build_query,
+        upper,
+        limit,
+        prefix,
+        delimiter,
+        path,
+        orig_marker,
+        transform_func,
+        stats,
+    ):
+        """
+        Walks the object index backwards for a reverse listing with a
+        delimiter, emitting subdir entries as they are found.
+
+        The rows below a subdir are skipped by continuing on the same cursor,
+        which is cheaper than a new query for small subdirs. Once a subdir
+        has more rows than the current skip budget the cursor is closed and a
+        new query is started below the subdir. The budget adapts to the
+        listing: it is halved each time it is exceeded and doubled, up to
+        :data:`REVERSE_LISTING_SKIP_ROWS`, each time a subdir fits within it.
+        While the budget is zero every subdir is sought past straight away,
+        except that every :data:`REVERSE_LISTING_SKIP_ROWS` subdirs the budget
+        is reset to one row to find out whether subdirs got smaller.
+
+        :param conn: DB connection object
+        :param build_query: a function that takes an upper bound for names,
+            or None, and returns a tuple of (query, args) selecting rows with
+            names less than that bound in descending name order.
+        :param upper: the initial upper bound for names, or None
+        :param limit: maximum number of entries to get
+        :param prefix: prefix query, possibly the empty string
+        :param delimiter: delimiter for query
+        :param path: the normalised path query, or None
+        :param orig_marker: a subdir entry equal to this value is not listed
+        :param transform_func: function called for each object row
+        :param stats: a dict in which to count ``rows_read``
+        :returns: a list of up to ``limit`` listing entries
+        """
+        results = []
+        budget = min(2, REVERSE_LISTING_SKIP_ROWS)
+        seeks = 0
+        while len(results) < limit:
+            query, args = build_query(upper)
+            curs = conn.execute(query, args)
+            curs.row_factory = None
+            skip_dir = None
+            skipped = 0
+            for row in curs:
+                stats["rows_read"] += 1
+                name = row[0]
+                if skip_dir is not None:
+                    if name.startswith(skip_dir):
+                        skipped += 1
+                        if skipped > budget:
+                            # big subdir, seek past it rather than walk it
+                            budget //= 2
+                            upper = skip_dir
+                            break
+                        continue
+                    skip_dir = None
+                    budget = min(max(budget * 2, 1), REVERSE_LISTING_SKIP_ROWS)
+                end = name.find(delimiter, len(prefix))
+                if path is not None:
+                    if name == path:
+                        continue
+                    if end < 0 or len(name) == end + len(delimiter):
+                        results.append(transform_func(row))
+                        if len(results) >= limit:
+                            break
+                        continue
+                elif end < 0:
+                    results.append(transform_func(row))
+                    if len(results) >= limit:
+                        break
+                    continue
+                skip_dir, skipped = name[: end + len(delimiter)], 0
+                if path is None and skip_dir != orig_marker:
+                    results.append([skip_dir, "0", 0, None, ""])
+                    if len(results) >= limit:
+                        break
+                if not budget:
+                    # recent subdirs were all big; seek straight past this
+                    # one, but every so often try walking one row again
+                    seeks += 1
+                    if seeks < REVERSE_LISTING_SKIP_ROWS:
+                        upper = skip_dir
+                        break
+                    budget, seeks = 1, 0
+            else:
+                break
+            curs.close()
+        return results
+
+    def list_merged_objects_iter(
+        self,
+        limit,
+        marker,
+        end_marker,
+        prefix,
+        delimiter,
+        path=None,
+        storage_policy_index=0,
+        reverse=False,
+        allow_reserved=False,
+    ):
+        """
+        Get a list of objects in the same way as :meth:`list_objects_iter`,
+        but while the db is sharding the list is made by merging the object
+        rows of both the retiring and the fresh db. Where both dbs have a row
+        for a name, the rows are merged in the same way as
+        :meth:`merge_items` merges an update into an existing row.
+
+        Rows are read from each db in pages, no more than are needed for the
+        listing.
+
+        :param limit: maximum number of entries to get
+        :param marker: marker query
+        :param end_marker: end marker query
+        :param prefix: prefix query
+        :param delimiter: delimiter for query
+        :param path: if defined, will set the prefix and delimiter based on
+                     the path
+        :param storage_policy_index: storage policy index for query
+        :param reverse: reverse the result order.
+        :param allow_reserved: exclude names with reserved-byte by default
+        :returns: list of tuples of (name, created_at, size, content_type,
+                  etag)
+        """
+        brokers = self.get_brokers()
+        if len(brokers) == 1:
+            return brokers[0].list_objects_iter(
+                limit,
+                marker,
+                end_marker,
+                prefix,
+                delimiter,
+                path,
+                storage_policy_index=storage_policy_index,
+                reverse=reverse,
+                allow_reserved=allow_reserved,
+            )
+        if six.PY2:
+            (marker, end_marker, prefix, delimiter, path) = utf8encode(
+                marker, end_marker, prefix, delimiter, path
+            )
+        if path is not None:
+            prefix = path
+            if path:
+                prefix = path = path.rstrip("/") + "/"
+            delimiter = "/"
+        elif delimiter and not prefix:
+            prefix = ""
+        lower, lower_inclusive, upper = None, False, None
+        if prefix:
+            lower, lower_inclusive = prefix, True
+            upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        if reverse:
+            marker, end_marker = end_marker, marker
+        if marker and (lower is None or marker >= lower):
+            lower, lower_inclusive = marker, False
+        if end_marker and (upper is None or end_marker < upper):
+            upper = end_marker
+
+        results = []
+        with self._op_stats("list_merged_objects_iter") as stats:
+            cursors = [
+                _ListingCursor(
+                    broker,
+                    lower,
+                    lower_inclusive,
+                    upper,
+                    reverse,
+                    storage_policy_index,
+                    allow_reserved,
+                    stats,
+                )
+                for broker in brokers
+            ]
+            while len(results) < limit:
+                wanted = limit - len(results)
+                heads = [(cursor, cursor.peek(wanted)) for cursor in cursors]
+                names = [row[0] for _cursor, row in heads if row]
+                if not names:
+                    break
+                name = max(names) if reverse else min(names)
+                # cursors are in retiring, fresh db order, so each row is
+                # merged into the row from the older db
+                record = None
+                for cursor, row in heads:
+                    if row and row[0] == name:
+                        cursor.pop()
+                        item = self._record_to_dict(row)
+                        if record is not None:
+                            update_new_item_from_existing(item, record)
+                        record = item
+                if record["deleted"]:
+                    continue
+                if delimiter:
+                    end = name.find(delimiter, len(prefix))
+                    if path is not None and name == path:
+                        continue
+                    if end >= 0 and (path is None or len(name) > end + len(delimiter)):
+                        dir_name = name[: end + len(delimiter)]
+                        if path is None and dir_name != marker:
+                            results.append([dir_name, "0", 0, None, ""])
+                        if reverse:
+                            bound = dir_name
+                        else:
+                            bound = "".join(
+                                [
+                                    name[:end],
+                                    delimiter[:-1],
+                                    chr(ord(delimiter[-1:]) + 1),
+                                ]
+                            )
+                        for cursor in cursors:
+                            cursor.seek(bound)
+                        continue
+                results.append(
+                    self._transform_record(
+                        (
+                            record["name"],
+                            record["created_at"],
+                            record["size"],
+                            record["content_type"],
+                            record["etag"],
+                        )
+                    )
+                )
+        return results
+
+    def _get_object_rows(
+        self,
+        limit,
+        lower,
+        lower_inclusive,
+        upper,
+        reverse,
+        storage_policy_index,
+        allow_reserved,
+    ):
+        """
+        Returns a list of up to ``limit`` object rows, deleted or not, of
+        (name, created_at, size, content_type, etag, deleted), in name order.
+
+        :param limit: maximum number of rows to get
+        :param lower: names must be greater than this, or None
+        :param lower_inclusive: if True, names may also be equal to ``lower``
+        :param upper: names must be less than this, or None
+        :param reverse: if True, return rows in descending name order
+        :param storage_policy_index: storage policy index of the rows
+        :param allow_reserved: if True, include names with the reserved byte
+        """
+        self._commit_puts_stale_ok()
+        conditions = []
+        args = []
+        if lower is not None:
+            conditions.append("name >= ?" if lower_inclusive else "name > ?")
+            args.append(lower)
+        if upper is not None:
+            conditions.append("name < ?")
+            args.append(upper)
+        if not allow_reserved:
+            conditions.append("name >= ?")
+            args.append(chr(ord(RESERVED_BYTE) + 1))
+        with self.get() as conn:
+            deleted_key = self._get_deleted_key(conn)
+            if self._has_column(conn, "object", "storage_policy_index"):
+                conditions.append("storage_policy_index = ?")
+                args.append(storage_policy_index)
+            query = (
+                "SELECT name, created_at, size, content_type, etag, %s "
+                "FROM object" % deleted_key
+            )
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += " ORDER BY name %s LIMIT ?" % ("DESC" if reverse else "")
+            curs = conn.execute(query, args + [limit])
+            curs.row_factory = None
+            return curs.fetchall()
+
     def get_objects(
         self, limit=None, marker="", end_marker="", include_deleted=None, since_row=None
     ):
@@ -1478,6 +2228,187 @@ class ContainerBroker(DatabaseBroker):
             allow_reserved=True,
         )
 
+    def export_objects(
+        self,
+        since_row=None,
+        order="rowid",
+        include_deleted=None,
+        ndjson=False,
+        limit=None,
+    ):
+        """
+        Yields every object row in the db, in all policies, without the
+        overhead of paging through :meth:`get_objects`.
+
+        All rows are read from a single read transaction so the export is a
+        consistent snapshot of the db; note that the transaction blocks
+        writes to the db until the returned generator is exhausted or
+        closed.
+
+        By default each row is yielded as a tuple of (name, created_at, size,
+        content_type, etag, deleted, storage_policy_index, ROWID).
+
+        :param since_row: include only items whose ROWID is greater than
+            the given row id; by default all rows are included.
+        :param order: either 'rowid' (default) to yield rows in the order
+            that they were last updated or 'name' to yield rows in name order.
+        :param include_deleted: if True, include only deleted objects; if
+            False, include only undeleted objects; otherwise (default), include
+            both deleted and undeleted objects.
+        :param ndjson: if True, yield each row as a line of JSON describing
+            the row as a dict, as returned by :meth:`get_objects` with an
+            additional 'ROWID' key, terminated by a newline.
+        :param limit: if set, the most rows to yield.
+        :raises ValueError: if ``order`` is not valid.
+        """
+        if order not in ("rowid", "name"):
+            raise ValueError("Invalid export order: %r" % order)
+        self._commit_puts_stale_ok()
+        with self.get() as conn:
+            query_keys = [
+                "name",
+                "created_at",
+                "size",
+                "content_type",
+                "etag",
+                "deleted",
+            ]
+            if self._has_column(conn, "object", "storage_policy_index"):
+                query_keys.append("storage_policy_index")
+            else:
+                query_keys.append("0 AS storage_policy_index")
+            query_keys.append("ROWID")
+            if include_deleted is None:
+                deleted_values = [0, 1]
+            else:
+                deleted_values = [1 if include_deleted else 0]
+
+            def execute(query, args):
+                curs = conn.execute(query, args)
+                curs.row_factory = None
+                cursors.append(curs)
+                return curs
+
+            cursors = []
+            conn.execute("BEGIN")
+            try:
+                if order == "name":
+                    # merge the name ordered rows of each deleted value
+                    # rather than have sqlite sort the whole table
+                    query = """
+                        SELECT %s FROM object
+                        WHERE deleted = ? AND ROWID > ?
+                        ORDER BY name
+                    """ % ", ".join(query_keys)
+                    rows = heapq.merge(
+                        *[
+                            execute(query, (deleted, since_row or -1))
+                            for deleted in deleted_values
+                        ]
+                    )
+                else:
+                    # +deleted so that the scan is by ROWID
+                    query = """
+                        SELECT %s FROM object
+                        WHERE +deleted IN (%s) AND ROWID > ?
+                        ORDER BY ROWID
+                    """ % (
+                        ", ".join(query_keys),
+                        ", ".join("?" * len(deleted_values)),
+                    )
+                    rows = execute(query, deleted_values + [since_row or -1])
+                if limit is not None:
+                    rows = itertools.islice(rows, limit)
+                if ndjson:
+                    keys = [key.split()[-1] for key in query_keys]
+                    for row in rows:
+                        yield json.dumps(dict(zip(keys, row))) + "\n"
+                else:
+                    for row in rows:
+                        yield row
+            except GeneratorExit:
+                # closed before the export completed; the transaction is
+                # still rolled back and the connection kept
+                pass
+            finally:
+                for curs in cursors:
+                    curs.close()
+
+    def export_object_columns(self, batch_size=100000, include_deleted=False):
+        """
+        Yields the object rows in the db as batches of columnar NumPy arrays,
+        suitable for vectorised aggregation.
+
+        The rows are read in ROWID order from a single read transaction, as
+        for :meth:`export_objects`. Each batch is a dict with keys:
+
+        * ``name_offsets``: int64 array of ``n + 1`` offsets into
+          ``name_data``; the name of row ``i`` is the utf-8 encoded bytes
+          ``name_data[name_offsets[i]:name_offsets[i + 1]]``
+        * ``name_data``: uint8 array of the concatenated names
+        * ``created_at``: float64 array of object timestamps
+        * ``size``: int64 array of object sizes
+        * ``content_type``: int32 array of indexes into ``content_types``
+        * ``content_types``: array of the distinct content types in the batch
+        * ``storage_policy_index``: int8 array of policy indexes
+        * ``deleted``: int8 array of deleted flags
+        * ``row_id``: int64 array of ROWIDs
+
+        NumPy must be installed to use this method.
+
+        :param batch_size: maximum number of rows in each batch
+        :param include_deleted: if True, include only deleted objects; if
+            False (default), include only undeleted objects; if None, include
+            both deleted and undeleted objects.
+        """
+        import numpy
+
+        rows = self.export_objects(include_deleted=include_deleted)
+        try:
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                (
+                    names,
+                    created_ats,
+                    sizes,
+                    content_types,
+                    _etags,
+                    deleted,
+                    policy_indexes,
+                    row_ids,
+                ) = zip(*batch)
+                del batch
+                names = [
+                    name.encode("utf-8") if isinstance(name, six.text_type) else name
+                    for name in names
+                ]
+                name_offsets = numpy.zeros(len(names) + 1, dtype=numpy.int64)
+                numpy.cumsum([len(name) for name in names], out=name_offsets[1:])
+                content_types, content_type_codes = numpy.unique(
+                    content_types, return_inverse=True
+                )
+                yield {
+                    "name_offsets": name_offsets,
+                    "name_data": numpy.frombuffer(b"".join(names), dtype=numpy.uint8),
+                    # the data timestamp is the first 16 chars of any
+                    # normalized, possibly encoded, created_at value
+                    "created_at": numpy.array(created_ats, dtype="U16").astype(
+                        numpy.float64
+                    ),
+                    "size": numpy.array(sizes, dtype=numpy.int64),
+                    "content_type": content_type_codes.astype(numpy.int32),
+                    "content_types": content_types,
+                    "storage_policy_index": numpy.array(
+                        policy_indexes, dtype=numpy.int8
+                    ),
+                    "deleted": numpy.array(deleted, dtype=numpy.int8),
+                    "row_id": numpy.array(row_ids, dtype=numpy.int64),
+                }
+        finally:
+            rows.close()
+
     def _transform_record(self, record):
         """
         Returns a tuple of (name, last-modified time, size, content_type and
@@ -1520,20 +2451,36 @@ class ContainerBroker(DatabaseBroker):
             elif not six.PY2 and isinstance(item["name"], six.binary_type):
                 item["name"] = item["name"].decode("utf-8")
 
-        def _really_really_merge_items(conn):
+        def _really_really_merge_items(conn, submitted):
+            stats["tpool_wait"] = time.time() - submitted
             curs = conn.cursor()
             if self.get_db_version(conn) >= 1:
                 query_mod = " deleted IN (0, 1) AND "
             else:
                 query_mod = ""
+            lock_start = time.time()
             curs.execute("BEGIN IMMEDIATE")
+            stats["lock_wait"] = time.time() - lock_start
+            # the name filter is only used while the db is locked, so its
+            # rows cannot change while it is brought up to date and used
+            name_filter = self._get_name_filter(conn) if self.name_filters else None
+            if name_filter:
+                # names that are definitely not in the db need no lookup
+                name_indexes = dict(
+                    (rec["name"], name_filter.indexes(rec["name"])) for rec in item_list
+                )
+                lookup_names = [
+                    name
+                    for name, indexes in name_indexes.items()
+                    if name_filter.might_contain(name, indexes)
+                ]
+            else:
+                lookup_names = [rec["name"] for rec in item_list]
             # Get sqlite records for objects in item_list that already exist.
             # We must chunk it up to avoid sqlite's limit of 999 args.
             records = {}
-            for offset in range(0, len(item_list), SQLITE_ARG_LIMIT):
-                chunk = [
-                    rec["name"] for rec in item_list[offset : offset + SQLITE_ARG_LIMIT]
-                ]
+            for offset in range(0, len(lookup_names), SQLITE_ARG_LIMIT):
+                chunk = lookup_names[offset : offset + SQLITE_ARG_LIMIT]
                 records.update(
                     ((rec[0], rec[6]), rec)
                     for rec in curs.execute(
@@ -1584,6 +2531,13 @@ class ContainerBroker(DatabaseBroker):
                         for rec in to_add.values()
                     ),
                 )
+            stats["rows_read"] = len(records)
+            stats["rows_written"] = len(to_delete) + len(to_add)
+            max_rowid = None
+            if name_filter and to_add:
+                for name, _policy_index in to_add:
+                    name_filter.add(name, name_indexes[name])
+                max_rowid = curs.execute("SELECT MAX(ROWID) FROM object").fetchone()[0]
             if source:
                 # for replication we rely on the remote end sending merges in
                 # order with no gaps to increment sync_points
@@ -1604,18 +2558,128 @@ class ContainerBroker(DatabaseBroker):
                         (sync_point, source),
                     )
             conn.commit()
+            if name_filter:
+                # the filter only covers the new rows once they are committed
+                if max_rowid:
+                    name_filter.covered_rowid = max(
+                        name_filter.covered_rowid, max_rowid
+                    )
+                self._maybe_save_name_filter(name_filter)
 
         def _really_merge_items(conn):
-            return tpool.execute(_really_really_merge_items, conn)
+            return self.tpool_execute(_really_really_merge_items, conn, time.time())
 
-        with self.get() as conn:
-            try:
-                return _really_merge_items(conn)
-            except sqlite3.OperationalError as err:
-                if "no such column: storage_policy_index" not in str(err):
-                    raise
+        with self._op_stats("merge_items") as stats, self.get() as conn:
+            if not self._has_column(conn, "object", "storage_policy_index"):
                 self._migrate_add_storage_policy(conn)
-                return _really_merge_items(conn)
+            return _really_merge_items(conn)
+
+    def tpool_execute(self, func, *args, **kwargs):
+        """
+        Run a function in eventlet's thread pool. If :attr:`drive_executors`
+        is set then the function is run by the executor of the db's drive.
+        If already in a thread of the pool the function is run directly.
+
+        :raises ~swift.container.executors.ExecutorQueueFull: if the drive's
+            executor has too many functions waiting to run
+        :returns: the function's return value
+        """
+        if in_tpool_thread():
+            return func(*args, **kwargs)
+        if self.drive_executors is None or self.db_file == ":memory:":
+            return tpool.execute(func, *args, **kwargs)
+        # db files are in <device>/<datadir>/<part>/<suffix>/<hash>/
+        device_path = self.db_file.rsplit(os.sep, 5)[0]
+        executor = self.drive_executors.get(device_path)
+        return executor.execute(func, *args, **kwargs)
+
+    @property
+    def name_filter_file(self):
+        """
+        The path of the file in which the name filter of this broker's db is
+        saved.
+        """
+        return os.path.splitext(self.db_file)[0] + ".names"
+
+    def _get_name_filter(self, conn):
+        """
+        Get the name filter for this broker's db, bringing it up to date with
+        the object table. The filter is taken from memory or from disk, or is
+        created and then built over successive calls. Must be called while
+        the db is locked.
+
+        :param conn: a connection to the locked db
+        :returns: a :class:`~swift.container.name_filter.NameFilter` of all
+            names in the object table, or None if the db has too few or too
+            many rows for a filter or its filter is still being built
+        """
+        if self.db_file == ":memory:":
+            return None
+        max_rowid = conn.execute("SELECT MAX(ROWID) FROM object").fetchone()[0] or 0
+        if not self.name_filter_min_rows <= max_rowid <= self.name_filter_max_rows:
+            return None
+        db_id = conn.execute("SELECT id FROM container_stat").fetchone()[0]
+
+        def is_valid(name_filter):
+            return (
+                name_filter is not None
+                and name_filter.db_id == db_id
+                and name_filter.covered_rowid <= max_rowid
+                and not name_filter.full
+            )
+
+        path = self.name_filter_file
+        name_filter = self.name_filters.get(path)
+        if name_filter is None:
+            name_filter = NameFilter.load(path)
+        if not is_valid(name_filter):
+            name_filter = NameFilter(2 * max_rowid, db_id)
+        self.name_filters.put(path, name_filter)
+
+        complete = max_rowid - name_filter.covered_rowid <= NAME_FILTER_BUILD_ROWS
+        for row_id, name in conn.execute(
+            "SELECT ROWID, name FROM object WHERE ROWID > ? ORDER BY ROWID LIMIT ?",
+            (name_filter.covered_rowid, NAME_FILTER_BUILD_ROWS),
+        ):
+            name_filter.add(name)
+            name_filter.covered_rowid = row_id
+        return name_filter if complete else None
+
+    def _maybe_save_name_filter(self, name_filter):
+        now = time.time()
+        if (
+            not name_filter.dirty
+            or now - name_filter.last_save < NAME_FILTER_SAVE_INTERVAL
+        ):
+            return
+        name_filter.last_save = now
+        try:
+            name_filter.save(self.name_filter_file)
+        except (IOError, OSError) as err:
+            self.logger.warning(
+                "Failed to save name filter %s: %s", self.name_filter_file, err
+            )
+
+    def get_name_filter_stats(self):
+        """
+        Returns a dict of statistics of the in-memory name filter of this
+        broker's db, or None if there is no such filter.
+        """
+        if not self.name_filters:
+            return None
+        name_filter = self.name_filters.get(self.name_filter_file)
+        if name_filter is None:
+            return None
+        return {
+            "capacity": name_filter.capacity,
+            "count": name_filter.count,
+            "covered_rowid": name_filter.covered_rowid,
+            "checks": name_filter.checks,
+            "maybes": name_filter.maybes,
+            "estimated_false_positive_rate": (
+                name_filter.estimated_false_positive_rate()
+            ),
+        }
 
     def merge_shard_ranges(self, shard_ranges):
         """
@@ -1644,7 +2708,9 @@ class ContainerBroker(DatabaseBroker):
 
         def _really_merge_items(conn):
             curs = conn.cursor()
+            lock_start = time.time()
             curs.execute("BEGIN IMMEDIATE")
+            stats["lock_wait"] = time.time() - lock_start
 
             # Get rows for items that already exist.
             # We must chunk it up to avoid sqlite's limit of 999 args.
@@ -1701,46 +2767,34 @@ class ContainerBroker(DatabaseBroker):
                         [item[k] for k in SHARD_RANGE_KEYS] for item in to_add.values()
                     ),
                 )
+            stats["rows_read"] = len(records)
+            stats["rows_written"] = len(to_delete) + len(to_add)
             conn.commit()
 
-        migrations = {
-            "no such column: reported": self._migrate_add_shard_range_reported,
-            "no such column: tombstones": self._migrate_add_shard_range_tombstones,
-            ("no such table: %s" % SHARD_RANGE_TABLE): self.create_shard_range_table,
-        }
-        migrations_done = set()
-        with self.get() as conn:
-            while True:
-                try:
-                    return _really_merge_items(conn)
-                except sqlite3.OperationalError as err:
-                    # Without the rollback, new enough (>= py37) python/sqlite3
-                    # will panic:
-                    #   sqlite3.OperationalError: cannot start a transaction
-                    #   within a transaction
-                    conn.rollback()
-                    for err_str, migration in migrations.items():
-                        if err_str in migrations_done:
-                            continue
-                        if err_str in str(err):
-                            migration(conn)
-                            migrations_done.add(err_str)
-                            break
-                    else:
-                        raise
+        with self._op_stats("merge_shard_ranges") as stats, self.get() as conn:
+            columns = self._get_columns(conn, SHARD_RANGE_TABLE)
+            if not columns:
+                self._migrate_once(
+                    conn,
+                    lambda: self.create_shard_range_table(conn),
+                    lambda: self._has_table(conn, SHARD_RANGE_TABLE),
+                )
+            else:
+                if "reported" not in columns:
+                    self._migrate_add_shard_range_reported(conn)
+                if "tombstones" not in columns:
+                    self._migrate_add_shard_range_tombstones(conn)
+            return _really_merge_items(conn)
 
     def get_reconciler_sync(self):
         with self.get() as conn:
-            try:
-                return conn.execute(
-                    """
-                    SELECT reconciler_sync_point FROM container_stat
-                    """
-                ).fetchone()[0]
-            except sqlite3.OperationalError as err:
-                if "no such column: reconciler_sync_point" not in str(err):
-                    raise
+            if not self._has_column(conn, "container_stat", "reconciler_sync_point"):
                 return -1
+            return conn.execute(
+                """
+                SELECT reconciler_sync_point FROM container_stat
+                """
+            ).fetchone()[0]
 
     def update_reconciler_sync(self, point):
         query = """
@@ -1748,13 +2802,9 @@ class ContainerBroker(DatabaseBroker):
             SET reconciler_sync_point = ?
         """
         with self.get() as conn:
-            try:
-                conn.execute(query, (point,))
-            except sqlite3.OperationalError as err:
-                if "no such column: reconciler_sync_point" not in str(err):
-                    raise
+            if not self._has_column(conn, "container_stat", "reconciler_sync_point"):
                 self._migrate_add_storage_policy(conn)
-                conn.execute(query, (point,))
+            conn.execute(query, (point,))
             conn.commit()
 
     def get_misplaced_since(self, start, count):
@@ -1779,27 +2829,31 @@ class ContainerBroker(DatabaseBroker):
         """
         self._commit_puts_stale_ok()
         with self.get() as conn:
-            try:
-                cur = conn.execute(qry, (start, count))
-            except sqlite3.OperationalError as err:
-                if "no such column: storage_policy_index" not in str(err):
-                    raise
+            if not (
+                self._has_column(conn, "object", "storage_policy_index")
+                and self._has_column(conn, "container_stat", "storage_policy_index")
+            ):
                 return []
+            cur = conn.execute(qry, (start, count))
             return list(dict(row) for row in cur.fetchall())
 
     def _migrate_add_container_sync_points(self, conn):
         """
         Add the x_container_sync_point columns to the 'container_stat' table.
         """
-        conn.executescript(
+        self._migrate_once(
+            conn,
+            lambda: conn.executescript(
+                """
+                BEGIN;
+                ALTER TABLE container_stat
+                ADD COLUMN x_container_sync_point1 INTEGER DEFAULT -1;
+                ALTER TABLE container_stat
+                ADD COLUMN x_container_sync_point2 INTEGER DEFAULT -1;
+                COMMIT;
             """
-            BEGIN;
-            ALTER TABLE container_stat
-            ADD COLUMN x_container_sync_point1 INTEGER DEFAULT -1;
-            ALTER TABLE container_stat
-            ADD COLUMN x_container_sync_point2 INTEGER DEFAULT -1;
-            COMMIT;
-        """
+            ),
+            lambda: self._has_column(conn, "container_stat", "x_container_sync_point1"),
         )
 
     def _migrate_add_storage_policy(self, conn):
@@ -1822,106 +2876,121 @@ class ContainerBroker(DatabaseBroker):
          * create container_stat view
         """
 
-        # I tried just getting the list of column names in the current
-        # container_stat table with a pragma table_info, but could never get
-        # it inside the same transaction as the DDL (non-DML) statements:
-        #     https://docs.python.org/2/library/sqlite3.html
-        #         #controlling-transactions
-        # So we just apply all pending migrations to container_stat and copy a
-        # static known list of column names into container_info.
-        try:
-            self._migrate_add_container_sync_points(conn)
-        except sqlite3.OperationalError as e:
-            if "duplicate column" in str(e):
-                conn.execute("ROLLBACK;")
-            else:
-                raise
+        def migrate():
+            # I tried just getting the list of column names in the current
+            # container_stat table with a pragma table_info, but could never get
+            # it inside the same transaction as the DDL (non-DML) statements:
+            #     https://docs.python.org/2/library/sqlite3.html
+            #         #controlling-transactions
+            # So we just apply all pending migrations to container_stat and copy a
+            # static known list of column names into container_info.
+            try:
+                self._migrate_add_container_sync_points(conn)
+            except sqlite3.OperationalError as e:
+                if "duplicate column" in str(e):
+                    conn.execute("ROLLBACK;")
+                else:
+                    raise
 
-        try:
-            conn.executescript(
+            try:
+                conn.executescript(
+                    """
+                    ALTER TABLE container_stat
+                    ADD COLUMN metadata TEXT DEFAULT '';
                 """
-                ALTER TABLE container_stat
-                ADD COLUMN metadata TEXT DEFAULT '';
-            """
-            )
-        except sqlite3.OperationalError as e:
-            if "duplicate column" not in str(e):
-                raise
+                )
+            except sqlite3.OperationalError as e:
+                if "duplicate column" not in str(e):
+                    raise
 
-        column_names = ", ".join(
-            (
-                "account",
-                "container",
-                "created_at",
-                "put_timestamp",
-                "delete_timestamp",
-                "reported_put_timestamp",
-                "reported_object_count",
-                "reported_bytes_used",
-                "hash",
-                "id",
-                "status",
-                "status_changed_at",
-                "metadata",
-                "x_container_sync_point1",
-                "x_container_sync_point2",
+            column_names = ", ".join(
+                (
+                    "account",
+                    "container",
+                    "created_at",
+                    "put_timestamp",
+                    "delete_timestamp",
+                    "reported_put_timestamp",
+                    "reported_object_count",
+                    "reported_bytes_used",
+                    "hash",
+                    "id",
+                    "status",
+                    "status_changed_at",
+                    "metadata",
+                    "x_container_sync_point1",
+                    "x_container_sync_point2",
+                )
             )
-        )
 
-        conn.executescript(
-            "BEGIN;"
-            + POLICY_STAT_TABLE_CREATE
-            + """
-                INSERT INTO policy_stat (
-                    storage_policy_index, object_count, bytes_used)
-                SELECT 0, object_count, bytes_used
-                FROM container_stat;
-
-                ALTER TABLE object
-                ADD COLUMN storage_policy_index INTEGER DEFAULT 0;
-
-                DROP TRIGGER object_insert;
-                DROP TRIGGER object_delete;
-            """
-            + POLICY_STAT_TRIGGER_SCRIPT
-            + CONTAINER_INFO_TABLE_SCRIPT
-            + """
-                INSERT INTO container_info (%s)
-                SELECT %s FROM container_stat;
+            conn.executescript(
+                "BEGIN;"
+                + POLICY_STAT_TABLE_CREATE
+                + """
+                    INSERT INTO policy_stat (
+                        storage_policy_index, object_count, bytes_used)
+                    SELECT 0, object_count, bytes_used
+                    FROM container_stat;
+
+                    ALTER TABLE object
+                    ADD COLUMN storage_policy_index INTEGER DEFAULT 0;
+
+                    DROP TRIGGER object_insert;
+                    DROP TRIGGER object_delete;
+                """
+                + POLICY_STAT_TRIGGER_SCRIPT
+                + CONTAINER_INFO_TABLE_SCRIPT
+                + """
+                    INSERT INTO container_info (%s)
+                    SELECT %s FROM container_stat;
 
-                DROP TABLE IF EXISTS container_stat;
-            """
-            % (column_names, column_names)
-            + CONTAINER_STAT_VIEW_SCRIPT
-            + "COMMIT;"
+                    DROP TABLE IF EXISTS container_stat;
+                """
+                % (column_names, column_names)
+                + CONTAINER_STAT_VIEW_SCRIPT
+                + "COMMIT;"
+            )
+
+        self._migrate_once(
+            conn,
+            migrate,
+            lambda: self._has_column(conn, "object", "storage_policy_index"),
         )
 
     def _migrate_add_shard_range_reported(self, conn):
         """
         Add the reported column to the 'shard_range' table.
         """
-        conn.executescript(
+        self._migrate_once(
+            conn,
+            lambda: conn.executescript(
+                """
+                BEGIN;
+                ALTER TABLE %s
+                ADD COLUMN reported INTEGER DEFAULT 0;
+                COMMIT;
             """
-            BEGIN;
-            ALTER TABLE %s
-            ADD COLUMN reported INTEGER DEFAULT 0;
-            COMMIT;
-        """
-            % SHARD_RANGE_TABLE
+                % SHARD_RANGE_TABLE
+            ),
+            lambda: self._has_column(conn, SHARD_RANGE_TABLE, "reported"),
         )
 
     def _migrate_add_shard_range_tombstones(self, conn):
         """
         Add the tombstones column to the 'shard_range' table.
         """
-        conn.executescript(
+        self._migrate_once(
+            conn,
+            lambda: conn.executescript(
+                """
+                BEGIN;
+                ALTER TABLE %s
+                ADD COLUMN tombstones INTEGER DEFAULT -1;
+                COMMIT;
             """
-            BEGIN;
-            ALTER TABLE %s
-            ADD COLUMN tombstones INTEGER DEFAULT -1;
-            COMMIT;
-        """
-            % SHARD_RANGE_TABLE
+                % SHARD_RANGE_TABLE
+            ),
+            lambda: self._has_column(conn, SHARD_RANGE_TABLE, "tombstones"),
         )
 
     def _reclaim_other_stuff(self, conn, age_timestamp, sync_timestamp):
@@ -1931,7 +3000,7 @@ class ContainerBroker(DatabaseBroker):
         # populate instance cache, but use existing conn to avoid deadlock
         # when it has a pending update
         self._populate_instance_cache(conn=conn)
-        try:
+        if self._has_table(conn, SHARD_RANGE_TABLE):
             conn.execute(
                 """
                 DELETE FROM %s WHERE deleted = 1 AND timestamp < ?
@@ -1940,9 +3009,6 @@ class ContainerBroker(DatabaseBroker):
                 % SHARD_RANGE_TABLE,
                 (sync_timestamp, self.path),
             )
-        except sqlite3.OperationalError as err:
-            if ("no such table: %s" % SHARD_RANGE_TABLE) not in str(err):
-                raise
 
     def _get_shard_range_rows(
         self,
@@ -1986,7 +3052,7 @@ class ContainerBroker(DatabaseBroker):
         # defaults to be used when legacy db's are missing columns
         default_values = {"reported": 0, "tombstones": -1}
 
-        def do_query(conn, defaults=None):
+        def do_query(conn, defaults):
             condition = ""
             conditions = []
             params = []
@@ -2024,26 +3090,11 @@ class ContainerBroker(DatabaseBroker):
             return [row for row in data]
 
         with self.maybe_get(connection) as conn:
-            defaults = set()
-            attempts = len(default_values) + 1
-            while attempts:
-                attempts -= 1
-                try:
-                    return do_query(conn, defaults)
-                except sqlite3.OperationalError as err:
-                    if ("no such table: %s" % SHARD_RANGE_TABLE) in str(err):
-                        return []
-                    if not attempts:
-                        raise
-                    new_defaults = set()
-                    for column in default_values.keys():
-                        if "no such column: %s" % column in str(err):
-                            new_defaults.add(column)
-                    if not new_defaults:
-                        raise
-                    if new_defaults.intersection(defaults):
-                        raise
-                    defaults.update(new_defaults)
+            columns = self._get_columns(conn, SHARD_RANGE_TABLE)
+            if not columns:
+                return []
+            defaults = set(default_values).difference(columns)
+            return do_query(conn, defaults)
 
     @classmethod
     def resolve_shard_range_states(cls, states):
@@ -2364,6 +3415,14 @@ class ContainerBroker(DatabaseBroker):
             if err.errno != errno.ENOENT:
                 self.logger.exception("Failed to unlink %r" % self._db_file)
             return False
+        name_filter_file = os.path.splitext(retiring_file)[0] + ".names"
+        if self.name_filters:
+            self.name_filters.pop(name_filter_file)
+        try:
+            os.unlink(name_filter_file)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                self.logger.warning("Failed to unlink %r: %s", name_filter_file, err)
 
         self.reload_db_files()
         if len(self.db_files) >= 2:
@@ -2404,6 +3463,15 @@ class ContainerBroker(DatabaseBroker):
                 self.stale_reads_ok,
                 force_db_file=True,
                 skip_commits=bool(db_files),
+                drive_executors=self.drive_executors,
+                tuning_profiles=self.tuning_profiles,
+                tuning_tiny_max_rows=self.tuning_tiny_max_rows,
+                tuning_huge_min_rows=self.tuning_huge_min_rows,
+                name_filters=self.name_filters,
+                name_filter_min_rows=self.name_filter_min_rows,
+                name_filter_max_rows=self.name_filter_max_rows,
+                prefix_stats_cache_depth=self.prefix_stats_cache_depth,
+                query_stats=self.query_stats,
             )
             brokers.append(sub_broker)
         return brokers
@@ -2625,56 +3693,57 @@ class ContainerBroker(DatabaseBroker):
         else:
             last_shard_upper = own_shard_range.lower
 
-        found_ranges = []
-        sub_broker = self.get_brokers()[0]
-        index = len(existing_ranges)
-        while limit is None or limit < 0 or len(found_ranges) < limit:
-            if progress + shard_size + minimum_shard_size > object_count:
-                # next shard point is within minimum_size rows of the final
-                # object name, or beyond it, so don't bother with db query.
-                # This shard will have <= shard_size + (minimum_size - 1) rows.
-                next_shard_upper = None
-            else:
-                try:
-                    next_shard_upper = sub_broker._get_next_shard_range_upper(
-                        shard_size, last_shard_upper
-                    )
-                except (sqlite3.OperationalError, LockTimeout):
-                    self.logger.exception(
-                        "Problem finding shard upper in %r: " % self.db_file
-                    )
-                    break
+        with self._op_stats("find_shard_ranges"):
+            found_ranges = []
+            sub_broker = self.get_brokers()[0]
+            index = len(existing_ranges)
+            while limit is None or limit < 0 or len(found_ranges) < limit:
+                if progress + shard_size + minimum_shard_size > object_count:
+                    # next shard point is within minimum_size rows of the final
+                    # object name, or beyond it, so don't bother with db query.
+                    # This shard will have <= shard_size + (minimum_size - 1) rows.
+                    next_shard_upper = None
+                else:
+                    try:
+                        next_shard_upper = sub_broker._get_next_shard_range_upper(
+                            shard_size, last_shard_upper
+                        )
+                    except (sqlite3.OperationalError, LockTimeout):
+                        self.logger.exception(
+                            "Problem finding shard upper in %r: " % self.db_file
+                        )
+                        break
 
-            if next_shard_upper is None or next_shard_upper > own_shard_range.upper:
-                # We reached the end of the container namespace, or possibly
-                # beyond if the container has misplaced objects. In either case
-                # limit the final shard range to own_shard_range.upper.
-                next_shard_upper = own_shard_range.upper
-                if progress_reliable:
-                    # object count may include misplaced objects so the final
-                    # shard size may not be accurate until cleaved, but at
-                    # least the sum of shard sizes will equal the unsharded
-                    # object_count
-                    shard_size = object_count - progress
-
-            # NB shard ranges are created with a non-zero object count so that
-            # the apparent container object count remains constant, and the
-            # container is non-deletable while shards have been found but not
-            # yet cleaved
-            found_ranges.append(
-                {
-                    "index": index,
-                    "lower": str(last_shard_upper),
-                    "upper": str(next_shard_upper),
-                    "object_count": shard_size,
-                }
-            )
+                if next_shard_upper is None or next_shard_upper > own_shard_range.upper:
+                    # We reached the end of the container namespace, or possibly
+                    # beyond if the container has misplaced objects. In either case
+                    # limit the final shard range to own_shard_range.upper.
+                    next_shard_upper = own_shard_range.upper
+                    if progress_reliable:
+                        # object count may include misplaced objects so the final
+                        # shard size may not be accurate until cleaved, but at
+                        # least the sum of shard sizes will equal the unsharded
+                        # object_count
+                        shard_size = object_count - progress
+
+                # NB shard ranges are created with a non-zero object count so that
+                # the apparent container object count remains constant, and the
+                # container is non-deletable while shards have been found but not
+                # yet cleaved
+                found_ranges.append(
+                    {
+                        "index": index,
+                        "lower": str(last_shard_upper),
+                        "upper": str(next_shard_upper),
+                        "object_count": shard_size,
+                    }
+                )
 
-            if next_shard_upper == own_shard_range.upper:
-                return found_ranges, True
+                if next_shard_upper == own_shard_range.upper:
+                    return found_ranges, True
 
-            progress += shard_size
-            last_shard_upper = next_shard_upper
-            index += 1
+                progress += shard_size
+                last_shard_upper = next_shard_upper
+                index += 1
 
-        return found_ranges, False
+            return found_ranges, False
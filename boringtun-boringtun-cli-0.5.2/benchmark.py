@@ -0,0 +1,684 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks for the container broker.
+
+Run with ``python -m swift.container.benchmark --help``.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from swift.common.utils import NullLogger, ShardRange, Timestamp
+from swift.container import backend, server
+from swift.container.backend import NAME_FILTER_CACHE_BYTES, ContainerBroker
+from swift.container.name_filter import NameFilterCache
+
+#: Words used to build long non-ASCII object names.
+UNICODE_WORDS = (
+    "\u00e9t\u00e9",
+    "\u00fcber",
+    "\u65e5\u672c\u8a9e",
+    "\u0444\u0430\u0439\u043b",
+    "\u03b1\u03c1\u03c7\u03b5\u03af\u03bf",
+    "\U0001f4e6",
+)
+
+
+def flat_names(num_objects):
+    """
+    Yields names with no pseudo-directories.
+    """
+    for i in range(num_objects):
+        yield "obj%010d" % i
+
+
+def versioned_names(num_objects, versions):
+    """
+    Yields names in the style of a versioned container, i.e. ``versions``
+    names below each of ``num_objects // versions`` pseudo-directories.
+    """
+    for i in range(max(num_objects // versions, 1)):
+        for v in range(versions):
+            yield "obj%06d/%010d" % (i, v)
+
+
+def deep_names(num_objects, depth, fanout=10):
+    """
+    Yields names below a tree of pseudo-directories ``depth`` levels deep,
+    with ``fanout`` pseudo-directories at each level.
+    """
+    for i in range(num_objects):
+        path = []
+        n = i
+        for _ in range(depth):
+            n, d = divmod(n, fanout)
+            path.append("dir%02d" % d)
+        path.append("obj%010d" % i)
+        yield "/".join(path)
+
+
+def unicode_names(num_objects, length):
+    """
+    Yields names of about ``length`` characters made of non-ASCII words.
+    """
+    for i in range(num_objects):
+        words = []
+        n = i
+        total = 11
+        while total < length:
+            n, w = divmod(n, len(UNICODE_WORDS))
+            words.append(UNICODE_WORDS[w])
+            total += len(UNICODE_WORDS[w]) + 1
+        yield "%s-%010d" % ("/".join(words), i)
+
+
+#: distribution name, function of (num_objects, args) that yields names
+DISTRIBUTIONS = {
+    "flat": lambda num_objects, args: flat_names(num_objects),
+    "versioned": lambda num_objects, args: versioned_names(num_objects, args.versions),
+    "deep": lambda num_objects, args: deep_names(num_objects, args.depth),
+    "unicode": lambda num_objects, args: unicode_names(num_objects, args.name_length),
+}
+
+
+def make_broker(
+    db_path,
+    names,
+    batch_size=10000,
+    policies=1,
+    deleted_ratio=0.0,
+    name_filters=False,
+):
+    """
+    Create and populate a container DB.
+
+    :param db_path: path for the new DB file
+    :param names: an iterable of object names
+    :param batch_size: number of rows merged per transaction
+    :param policies: rows are spread over this many storage policy indexes
+    :param deleted_ratio: the fraction of rows that are marked deleted
+    :param name_filters: if True, the broker keeps a name filter
+    :return: an instance of
+        :class:`~swift.container.backend.ContainerBroker`
+    """
+    broker = ContainerBroker(
+        db_path,
+        account="bench",
+        container="bench",
+        name_filters=NameFilterCache(NAME_FILTER_CACHE_BYTES) if name_filters else None,
+    )
+    broker.initialize(Timestamp.now().internal, 0)
+    ts = Timestamp.now().internal
+    batch = []
+    for i, name in enumerate(names):
+        batch.append(
+            {
+                "name": name,
+                "created_at": ts,
+                "size": 0,
+                "content_type": "application/octet-stream",
+                "etag": "d41d8cd98f00b204e9800998ecf8427e",
+                "deleted": int(int((i + 1) * deleted_ratio) > int(i * deleted_ratio)),
+                "storage_policy_index": i % policies,
+            }
+        )
+        if len(batch) >= batch_size:
+            broker.merge_items(batch)
+            batch = []
+    if batch:
+        broker.merge_items(batch)
+    return broker
+
+
+def peak_rss_kb():
+    """
+    Returns the peak resident set size of this process, in KiB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # reported in bytes rather than KiB
+        peak //= 1024
+    return peak
+
+
+def percentile(sorted_values, pct):
+    return sorted_values[int(round(pct / 100.0 * (len(sorted_values) - 1)))]
+
+
+def time_calls(func, repeat, setup=None, items=1):
+    """
+    Call ``func`` ``repeat`` times.
+
+    :param func: the function to time
+    :param repeat: the number of calls
+    :param setup: an optional function, called before each call of ``func``
+        and not timed, whose return value is passed to ``func``
+    :param items: the number of items, such as rows, processed by each call
+    :return: a dict with call time statistics in milliseconds, the number of
+        items processed per second and the process's peak RSS
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            arg = setup()
+            start = time.time()
+            func(arg)
+        else:
+            start = time.time()
+            func()
+        timings.append((time.time() - start) * 1000)
+    timings.sort()
+    mean = sum(timings) / len(timings)
+    return {
+        "calls": repeat,
+        "min_ms": timings[0],
+        "mean_ms": mean,
+        "p50_ms": percentile(timings, 50),
+        "p90_ms": percentile(timings, 90),
+        "p99_ms": percentile(timings, 99),
+        "max_ms": timings[-1],
+        "items_per_sec": items * 1000 / mean if mean else None,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+def listing_cases(sample_name):
+    """
+    Returns a list of (case name, list_objects_iter keyword args) tuples
+    whose prefixes and markers are taken from the given object name.
+    """
+    if "/" in sample_name:
+        directory = sample_name.rsplit("/", 1)[0]
+        prefix = sample_name.split("/", 1)[0] + "/"
+    else:
+        directory = None
+        prefix = sample_name[: len(sample_name) // 2]
+    cases = [
+        ("forward", {}),
+        ("reverse", {"reverse": True}),
+        ("forward+delimiter", {"delimiter": "/"}),
+        ("reverse+delimiter", {"delimiter": "/", "reverse": True}),
+        ("forward+prefix", {"prefix": prefix}),
+        ("reverse+prefix", {"prefix": prefix, "reverse": True}),
+        ("forward+prefix+delimiter", {"prefix": prefix, "delimiter": "/"}),
+        (
+            "reverse+prefix+delimiter",
+            {"prefix": prefix, "delimiter": "/", "reverse": True},
+        ),
+        ("forward+marker", {"marker": sample_name}),
+        (
+            "reverse+marker+delimiter",
+            {"marker": sample_name, "delimiter": "/", "reverse": True},
+        ),
+    ]
+    if directory:
+        cases.append(("forward+path", {"path": directory}))
+        cases.append(("reverse+path", {"path": directory, "reverse": True}))
+    return cases
+
+
+def bench_listings(broker, limit, repeat, sample_name):
+    results = []
+    for case, kwargs in listing_cases(sample_name):
+        call_kwargs = {
+            "marker": "",
+            "end_marker": None,
+            "prefix": None,
+            "delimiter": None,
+        }
+        call_kwargs.update(kwargs)
+
+        def do_listing():
+            broker.list_objects_iter(limit, **call_kwargs)
+
+        result = {"op": "list_objects_iter", "case": case, "limit": limit}
+        result.update(time_calls(do_listing, repeat))
+        results.append(result)
+    return results
+
+
+def new_rows(prefix, count, ts=None):
+    ts = ts or Timestamp.now().internal
+    return [
+        {
+            "name": "%s%06d" % (prefix, i),
+            "created_at": ts,
+            "size": 1,
+            "content_type": "text/plain",
+            "etag": "d41d8cd98f00b204e9800998ecf8427e",
+            "deleted": 0,
+            "storage_policy_index": 0,
+        }
+        for i in range(count)
+    ]
+
+
+def bench_merge_items(broker, names, batch_size, repeat):
+    counter = itertools.count()
+
+    def make_insert_batch():
+        return new_rows("zz-merge-%d/" % next(counter), batch_size)
+
+    existing = list(itertools.islice(names, batch_size))
+
+    def make_update_batch():
+        ts = Timestamp.now().internal
+        rows = new_rows("", len(existing), ts)
+        for row, name in zip(rows, existing):
+            row["name"] = name
+        return rows
+
+    if broker.name_filters:
+        # build the name filter before timing merges
+        stats = None
+        while stats is None or stats["covered_rowid"] < broker.get_max_row():
+            broker.merge_items([])
+            stats = broker.get_name_filter_stats()
+            if stats is None:
+                # the db is too small for a filter
+                break
+
+    results = []
+    for case, setup in (("insert", make_insert_batch), ("update", make_update_batch)):
+        result = {"op": "merge_items", "case": case, "batch_size": batch_size}
+        before = broker.get_name_filter_stats()
+        result.update(
+            time_calls(broker.merge_items, repeat, setup=setup, items=batch_size)
+        )
+        after = broker.get_name_filter_stats()
+        if before and after and after["checks"] > before["checks"]:
+            # for inserts every name is new, so this is the filter's false
+            # positive rate
+            result["name_filter_maybe_rate"] = float(
+                after["maybes"] - before["maybes"]
+            ) / (after["checks"] - before["checks"])
+            result["name_filter_estimated_fp_rate"] = after[
+                "estimated_false_positive_rate"
+            ]
+        results.append(result)
+    return results
+
+
+def bench_merge_shard_ranges(broker, bounds, repeat):
+    def make_shard_ranges():
+        ts = Timestamp.now()
+        lowers = [""] + bounds
+        uppers = bounds + [""]
+        return [
+            ShardRange(".shards_bench/bench-%d" % i, ts, lower, upper, object_count=i)
+            for i, (lower, upper) in enumerate(zip(lowers, uppers))
+        ]
+
+    result = {
+        "op": "merge_shard_ranges",
+        "case": "update",
+        "shard_ranges": len(bounds) + 1,
+    }
+    result.update(
+        time_calls(
+            broker.merge_shard_ranges,
+            repeat,
+            setup=make_shard_ranges,
+            items=len(bounds) + 1,
+        )
+    )
+    return [result]
+
+
+def bench_get_info(broker, repeat):
+    result = {"op": "get_info", "case": "default"}
+    result.update(time_calls(broker.get_info, repeat))
+    return [result]
+
+
+def bench_find_shard_ranges(broker, shard_size, repeat):
+    def do_find():
+        broker.find_shard_ranges(shard_size)
+
+    result = {"op": "find_shard_ranges", "case": "all", "shard_size": shard_size}
+    result.update(time_calls(do_find, repeat))
+    return [result]
+
+
+def bench_remove_objects(broker, batch_size, repeat):
+    counter = itertools.count()
+
+    def make_range():
+        prefix = "zz-remove-%d" % next(counter)
+        broker.merge_items(new_rows(prefix + "/", batch_size))
+        return prefix
+
+    def do_remove(prefix):
+        broker.remove_objects(prefix, prefix + "/~")
+
+    result = {"op": "remove_objects", "case": "range", "batch_size": batch_size}
+    result.update(time_calls(do_remove, repeat, setup=make_range, items=batch_size))
+    return [result]
+
+
+def bench_set_sharding_state(broker, tmpdir, repeat):
+    counter = itertools.count()
+    copies = []
+
+    def make_copy():
+        copy_dir = os.path.join(tmpdir, "sharding-%d" % next(counter))
+        os.mkdir(copy_dir)
+        copy_path = os.path.join(copy_dir, os.path.basename(broker.db_file))
+        shutil.copy(broker.db_file, copy_path)
+        copies.append(copy_dir)
+        copy = ContainerBroker(
+            copy_path,
+            account="bench",
+            container="bench",
+            tuning_profiles=broker.tuning_profiles,
+        )
+        copy.enable_sharding(Timestamp.now())
+        return copy
+
+    def do_set_sharding_state(copy):
+        copy.set_sharding_state()
+
+    result = {"op": "set_sharding_state", "case": "default"}
+    try:
+        result.update(time_calls(do_set_sharding_state, repeat, setup=make_copy))
+    finally:
+        for copy_dir in copies:
+            shutil.rmtree(copy_dir, ignore_errors=True)
+    return [result]
+
+
+#: The number of header conversions timed by each call of the responses
+#: benchmark, which are too quick to time one by one.
+HEADER_CALLS = 1000
+
+
+def bench_responses(broker, limit, repeat, devices):
+    """
+    Time the conversion of a container's info to response headers, done by
+    every HEAD and GET, and of listed rows to listing records.
+    """
+    controller = server.ContainerController(
+        {"devices": devices, "mount_check": "false"}, logger=NullLogger()
+    )
+    info = broker.get_info()
+    records = broker.list_objects_iter(limit, "", None, None, None)
+
+    def do_headers():
+        for _ in range(HEADER_CALLS):
+            server.gen_resp_headers(info)
+
+    def do_records():
+        for record in records:
+            controller.update_data_record(record)
+
+    headers_result = {"op": "responses", "case": "headers"}
+    headers_result.update(time_calls(do_headers, repeat, items=HEADER_CALLS))
+    listing_result = {"op": "responses", "case": "listing", "limit": limit}
+    listing_result.update(time_calls(do_records, repeat, items=len(records)))
+    return [headers_result, listing_result]
+
+
+def set_tuning(broker, tuning):
+    """
+    Set the sqlite tuning used by a broker's new connections.
+
+    :param broker: the broker
+    :param tuning: ``off`` for no tuning, ``auto`` for the default tuning
+        profiles chosen by db size, or the name of a profile to use for every
+        db
+    """
+    if tuning == "off":
+        broker.tuning_profiles = None
+    elif tuning == "auto":
+        broker.tuning_profiles = backend.parse_tuning_conf({})
+    else:
+        pragmas = backend.DEFAULT_TUNING_PROFILES[tuning]
+        broker.tuning_profiles = dict(
+            (name, pragmas) for name in backend.DEFAULT_TUNING_PROFILES
+        )
+    # a new connection picks up the tuning profile
+    broker.conn = None
+
+
+#: The operations that may be benchmarked, in the order they are run.
+OPS = (
+    "list_objects_iter",
+    "get_info",
+    "find_shard_ranges",
+    "merge_shard_ranges",
+    "merge_items",
+    "remove_objects",
+    "set_sharding_state",
+    "responses",
+)
+
+
+def bench_container(num_objects, args, tmpdir):
+    """
+    Create a container DB with ``num_objects`` objects and run the selected
+    benchmarks against it.
+
+    :return: a list of result dicts
+    """
+    names = DISTRIBUTIONS[args.distribution]
+    db_dir = tempfile.mkdtemp(dir=tmpdir)
+    try:
+        start = time.time()
+        broker = make_broker(
+            os.path.join(db_dir, "bench.db"),
+            names(num_objects, args),
+            policies=args.policies,
+            deleted_ratio=args.deleted_ratio,
+            name_filters=args.name_filters,
+        )
+        elapsed = time.time() - start
+        results = [
+            {
+                "op": "make_broker",
+                "case": "populate",
+                "calls": 1,
+                "mean_ms": elapsed * 1000,
+                "items_per_sec": num_objects / elapsed if elapsed else None,
+                "peak_rss_kb": peak_rss_kb(),
+            }
+        ]
+        num_bounds = min(args.shard_ranges, num_objects) - 1
+        step = max(num_objects // (num_bounds + 1), 1)
+        bounds = sorted(
+            set(
+                itertools.islice(
+                    itertools.islice(names(num_objects, args), step, None, step),
+                    num_bounds,
+                )
+            )
+        )
+        sample_name = next(
+            itertools.islice(names(num_objects, args), num_objects // 2, None)
+        )
+        for tuning in args.tuning:
+            set_tuning(broker, tuning)
+            first = len(results)
+            for op in args.ops:
+                if op == "list_objects_iter":
+                    results.extend(
+                        bench_listings(broker, args.limit, args.repeat, sample_name)
+                    )
+                elif op == "get_info":
+                    results.extend(bench_get_info(broker, args.repeat))
+                elif op == "find_shard_ranges":
+                    results.extend(
+                        bench_find_shard_ranges(
+                            broker,
+                            max(num_objects // args.shard_ranges, 1),
+                            args.repeat,
+                        )
+                    )
+                elif op == "merge_shard_ranges":
+                    results.extend(
+                        bench_merge_shard_ranges(broker, bounds, args.repeat)
+                    )
+                elif op == "merge_items":
+                    results.extend(
+                        bench_merge_items(
+                            broker,
+                            names(num_objects, args),
+                            args.batch_size,
+                            args.repeat,
+                        )
+                    )
+                elif op == "remove_objects":
+                    results.extend(
+                        bench_remove_objects(broker, args.batch_size, args.repeat)
+                    )
+                elif op == "set_sharding_state":
+                    results.extend(
+                        bench_set_sharding_state(broker, db_dir, args.repeat)
+                    )
+                elif op == "responses":
+                    results.extend(
+                        bench_responses(broker, args.limit, args.repeat, db_dir)
+                    )
+            for result in results[first:]:
+                result["tuning"] = tuning
+    finally:
+        shutil.rmtree(db_dir, ignore_errors=True)
+    for result in results:
+        result.update(
+            {
+                "objects": num_objects,
+                "distribution": args.distribution,
+                "policies": args.policies,
+                "deleted_ratio": args.deleted_ratio,
+                "name_filters": args.name_filters,
+            }
+        )
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark container broker operations against synthetic "
+        "containers; results are written to stdout as one JSON object per "
+        "line."
+    )
+    parser.add_argument(
+        "--objects",
+        type=int,
+        nargs="+",
+        default=[100000],
+        help="number of objects in the DB; a DB is benchmarked for each value",
+    )
+    parser.add_argument(
+        "--distribution",
+        choices=sorted(DISTRIBUTIONS),
+        default="versioned",
+        help="shape of the object names",
+    )
+    parser.add_argument(
+        "--versions",
+        type=int,
+        default=100,
+        help="number of objects below each pseudo-directory of a versioned "
+        "distribution",
+    )
+    parser.add_argument(
+        "--depth",
+        type=int,
+        default=4,
+        help="number of pseudo-directory levels of a deep distribution",
+    )
+    parser.add_argument(
+        "--name-length",
+        type=int,
+        default=200,
+        help="approximate name length, in characters, of a unicode distribution",
+    )
+    parser.add_argument(
+        "--policies",
+        type=int,
+        default=1,
+        help="number of storage policy indexes the objects are spread over",
+    )
+    parser.add_argument(
+        "--deleted-ratio",
+        type=float,
+        default=0.0,
+        help="fraction of rows that are marked deleted",
+    )
+    parser.add_argument(
+        "--ops",
+        nargs="+",
+        choices=OPS,
+        default=list(OPS),
+        help="operations to benchmark",
+    )
+    parser.add_argument(
+        "--tuning",
+        nargs="+",
+        choices=["off", "auto"] + sorted(backend.DEFAULT_TUNING_PROFILES),
+        default=["off"],
+        help="sqlite tuning profiles with which the operations are run; "
+        "'auto' chooses a profile by db size",
+    )
+    parser.add_argument(
+        "--name-filters",
+        action="store_true",
+        help="use Bloom filters of object names in merge_items",
+    )
+    parser.add_argument(
+        "--limit", type=int, default=1000, help="listing limit for each call"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="number of rows merged or removed by each call",
+    )
+    parser.add_argument(
+        "--shard-ranges",
+        type=int,
+        default=100,
+        help="number of shard ranges merged or found",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=20, help="number of calls per case"
+    )
+    parser.add_argument(
+        "--tmpdir", default=None, help="directory in which to create DB files"
+    )
+    args = parser.parse_args(args)
+
+    tmpdir = tempfile.mkdtemp(dir=args.tmpdir)
+    try:
+        for num_objects in args.objects:
+            for result in bench_container(num_objects, args, tmpdir):
+                sys.stdout.write(json.dumps(result) + "\n")
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per-drive limits on the use of eventlet's thread pool.
+"""
+
+import os
+import time
+
+from eventlet import patcher, tpool
+from eventlet.semaphore import Semaphore
+
+#: marks the OS threads of eventlet's thread pool in which executors have run
+#: functions; a non-monkeypatched local, so that it is per OS thread
+_thread_local = patcher.original("threading").local()
+
+
+def in_tpool_thread():
+    """
+    Returns True if called from a thread of eventlet's thread pool in which
+    an executor has run a function. Such calls must not wait on eventlet
+    primitives, which only work in the hub's thread.
+    """
+    return getattr(_thread_local, "in_tpool", False)
+
+
+def _run_in_tpool(func, args, kwargs):
+    _thread_local.in_tpool = True
+    return func(*args, **kwargs)
+
+
+class ExecutorQueueFull(Exception):
+    """
+    Raised when a function cannot be run because its drive's executor has as
+    many functions waiting as it allows.
+    """
+
+    def __init__(self, drive):
+        super(ExecutorQueueFull, self).__init__(
+            "Too many tpool calls queued for %s" % drive
+        )
+        self.drive = drive
+
+
+class DriveExecutor(object):
+    """
+    Runs functions in eventlet's thread pool on behalf of one drive, with at
+    most ``max_threads`` of them running at once, so that a slow drive cannot
+    occupy every thread in the pool.
+
+    :param drive: the name of the drive
+    :param max_threads: the most functions run at once
+    :param max_queue: the most functions waiting to run; further functions
+        are rejected
+    """
+
+    def __init__(self, drive, max_threads, max_queue):
+        self.drive = drive
+        self.max_threads = max_threads
+        self.max_queue = max_queue
+        self.semaphore = Semaphore(max_threads)
+        self.queued = 0
+        self.running = 0
+        self.executed = 0
+        self.rejected = 0
+        #: the total and greatest time spent waiting to run, in seconds
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def execute(self, func, *args, **kwargs):
+        """
+        Run a function in eventlet's thread pool, once one of the drive's
+        threads is free. If called from a thread of the pool, for example by
+        a function that the executor is already running, the function is
+        run directly rather than waiting for another of the drive's threads.
+
+        :raises ExecutorQueueFull: if ``max_queue`` functions are already
+            waiting to run
+        :returns: the function's return value
+        """
+        if in_tpool_thread():
+            return func(*args, **kwargs)
+        if self.semaphore.locked() and self.queued >= self.max_queue:
+            self.rejected += 1
+            raise ExecutorQueueFull(self.drive)
+        start = time.time()
+        self.queued += 1
+        try:
+            self.semaphore.acquire()
+        finally:
+            self.queued -= 1
+        waited = time.time() - start
+        self.wait_time += waited
+        self.max_wait_time = max(self.max_wait_time, waited)
+        self.running += 1
+        try:
+            return tpool.execute(_run_in_tpool, func, args, kwargs)
+        finally:
+            self.running -= 1
+            self.executed += 1
+            self.semaphore.release()
+
+    def stats(self):
+        """
+        Returns a dict of the executor's queue depth, running functions and
+        counters.
+        """
+        return {
+            "max_threads": self.max_threads,
+            "max_queue": self.max_queue,
+            "queued": self.queued,
+            "running": self.running,
+            "executed": self.executed,
+            "rejected": self.rejected,
+            "wait_time": self.wait_time,
+            "max_wait_time": self.max_wait_time,
+            "mean_wait_time": self.wait_time / self.executed if self.executed else 0.0,
+        }
+
+
+class DriveExecutors(object):
+    """
+    A :class:`DriveExecutor` for each drive, created on demand.
+
+    Note that the executors share eventlet's thread pool, whose size should be
+    at least the number of drives times ``max_threads`` for the drives to be
+    fully isolated from each other.
+
+    :param max_threads: the most functions run at once for each drive
+    :param max_queue: the most functions waiting to run for each drive
+    """
+
+    def __init__(self, max_threads, max_queue):
+        self.max_threads = max_threads
+        self.max_queue = max_queue
+        #: maps device path -> DriveExecutor
+        self.executors = {}
+
+    def get(self, device_path):
+        """
+        Get the executor of a drive.
+
+        :param device_path: the path of the drive's mount point
+        """
+        executor = self.executors.get(device_path)
+        if executor is None:
+            executor = self.executors[device_path] = DriveExecutor(
+                os.path.basename(device_path), self.max_threads, self.max_queue
+            )
+        return executor
+
+    def stats(self):
+        """
+        Returns a dict mapping each drive's name to its executor's stats.
+        """
+        return dict(
+            (executor.drive, executor.stats()) for executor in self.executors.values()
+        )
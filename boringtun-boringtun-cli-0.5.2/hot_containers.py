@@ -0,0 +1,182 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Detection of the containers with the most requests and merged rows.
+"""
+
+import heapq
+import time
+
+
+class SpaceSaving(object):
+    """
+    The space-saving algorithm's approximate top-K of keys by total weight,
+    in memory bounded by ``capacity`` regardless of the number of keys.
+
+    Every key whose total weight is more than the total weight of all keys
+    divided by ``capacity`` is guaranteed to be tracked. A tracked key's
+    count may overestimate its total weight, by at most its ``error``.
+
+    :param capacity: the most keys tracked
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        #: maps key -> [count, error]
+        self.counts = {}
+        #: a min-heap of (count, key) with an entry for each tracked key;
+        #: counts only grow, so an entry's count may be less than the key's
+        #: count, and is brought up to date when it reaches the top
+        self.heap = []
+
+    def add(self, key, weight=1):
+        """
+        Add weight to a key.
+
+        :returns: the key that was evicted to make room for the key, if any
+        """
+        entry = self.counts.get(key)
+        if entry is not None:
+            entry[0] += weight
+            return None
+        if len(self.counts) < self.capacity:
+            self.counts[key] = [weight, 0]
+            heapq.heappush(self.heap, (weight, key))
+            return None
+        while True:
+            min_count, evicted = self.heap[0]
+            count = self.counts[evicted][0]
+            if count == min_count:
+                break
+            heapq.heapreplace(self.heap, (count, evicted))
+        # the new key takes over the count of the least counted key, which
+        # is the most by which the new key may have been undercounted
+        heapq.heapreplace(self.heap, (min_count + weight, key))
+        del self.counts[evicted]
+        self.counts[key] = [min_count + weight, min_count]
+        return evicted
+
+    def top(self, n):
+        """
+        Returns a list of up to ``n`` tuples of (key, count, error), highest
+        count first.
+        """
+        entries = sorted(self.counts.items(), key=lambda item: -item[1][0])
+        return [(key, count, error) for key, (count, error) in entries[:n]]
+
+
+class HotContainers(object):
+    """
+    Tracks the containers with the most requests and with the most rows
+    merged, over successive intervals. At the end of each interval the top
+    containers are logged and the tracking starts again.
+
+    Containers are identified by the hash of their path, so that requests
+    which only name a container's hash, such as REPLICATE requests, are
+    counted along with those that name the container.
+
+    :param capacity: the most containers tracked by each measure
+    :param interval: the length of an interval, in seconds
+    :param top: the number of containers logged and reported for each
+        measure
+    :param logger: a logger instance
+    """
+
+    def __init__(self, capacity, interval=300, top=10, logger=None):
+        self.capacity = capacity
+        self.interval = interval
+        self.top = top
+        self.logger = logger
+        self.last = None
+        self._reset(time.time())
+
+    def _reset(self, now):
+        self.start = now
+        self.requests = SpaceSaving(self.capacity)
+        self.rows = SpaceSaving(self.capacity)
+        #: maps the hash of each tracked container to its path, when known
+        self.names = {}
+
+    def record(self, key, name=None, requests=1, rows=0):
+        """
+        Count a container's requests and merged rows.
+
+        :param key: the hash of the container's path
+        :param name: the container's ``account/container`` path, if known
+        :param requests: the number of requests to count
+        :param rows: the number of merged rows to count
+        """
+        now = time.time()
+        if now - self.start >= self.interval:
+            self.report(now)
+        evicted = []
+        if requests:
+            evicted.append(self.requests.add(key, requests))
+        if rows:
+            evicted.append(self.rows.add(key, rows))
+        for evicted_key in evicted:
+            if (
+                evicted_key is not None
+                and evicted_key not in self.requests.counts
+                and evicted_key not in self.rows.counts
+            ):
+                self.names.pop(evicted_key, None)
+        if name and (key in self.requests.counts or key in self.rows.counts):
+            self.names[key] = name
+
+    def _summarise(self, now):
+        elapsed = max(now - self.start, 1e-9)
+        summary = {"start": self.start, "elapsed": elapsed}
+        for measure, sketch in (("requests", self.requests), ("rows", self.rows)):
+            summary[measure] = [
+                {
+                    "container": self.names.get(key, key),
+                    "count": count,
+                    "error": error,
+                    "rate": count / elapsed,
+                }
+                for key, count, error in sketch.top(self.top)
+            ]
+        return summary
+
+    def report(self, now=None):
+        """
+        Log the top containers of the current interval and start a new
+        interval.
+        """
+        now = time.time() if now is None else now
+        self.last = self._summarise(now)
+        if self.logger:
+            for measure in ("requests", "rows"):
+                if self.last[measure]:
+                    self.logger.info(
+                        "Hot containers by %s over %ds: %s",
+                        measure,
+                        self.last["elapsed"],
+                        ", ".join(
+                            "%s=%d (%.1f/s)"
+                            % (entry["container"], entry["count"], entry["rate"])
+                            for entry in self.last[measure]
+                        ),
+                    )
+        self._reset(now)
+
+    def summary(self):
+        """
+        Returns a JSON-serialisable dict with the top containers of the
+        ``current`` interval and of the ``last`` complete interval, if any.
+        """
+        return {"current": self._summarise(time.time()), "last": self.last}
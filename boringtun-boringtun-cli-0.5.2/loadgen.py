@@ -0,0 +1,455 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Load generator for the container server.
+
+Run with ``python -m swift.container.loadgen --help``.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import eventlet
+import eventlet.wsgi
+from eventlet import GreenPool
+
+from swift.common.bufferedhttp import http_connect
+from swift.common.swob import Request
+from swift.common.utils import ShardRange, Timestamp
+from swift.container.benchmark import percentile
+from swift.container.server import app_factory
+
+#: The drive on which containers are created.
+DRIVE = "sda1"
+
+#: The partition in which containers are created.
+PARTITION = "0"
+
+#: The account in which containers are created.
+ACCOUNT = "a"
+
+#: operation, relative weight of the operation in the request mix
+DEFAULT_MIX = (
+    ("object_put", 40),
+    ("object_delete", 10),
+    ("head", 15),
+    ("listing", 20),
+    ("update", 10),
+    ("shard_put", 2),
+    ("container_put", 3),
+)
+
+
+def object_name(rng, args):
+    return "dir%02d/obj%06d" % (
+        rng.randrange(args.dirs),
+        rng.randrange(args.objects_per_container),
+    )
+
+
+def object_record(name, timestamp, deleted=0):
+    return {
+        "name": name,
+        "created_at": timestamp,
+        "size": 0 if deleted else 1024,
+        "content_type": "application/octet-stream",
+        "etag": "d41d8cd98f00b204e9800998ecf8427e",
+        "deleted": deleted,
+        "storage_policy_index": 0,
+    }
+
+
+class Workload(object):
+    """
+    Makes the requests of a mix of container server operations.
+
+    :param args: the parsed command line arguments
+    :param account_addr: the (host, port) of the stub account server
+    :param seed: seed for the choice of operations and names
+    """
+
+    def __init__(self, args, account_addr, seed=None):
+        self.args = args
+        self.account_host = "%s:%d" % account_addr
+        self.rng = random.Random(seed)
+        self.ops = [op for op, _weight in args.mix]
+        self.cum_weights = []
+        total = 0
+        for _op, weight in args.mix:
+            total += weight
+            self.cum_weights.append(total)
+
+    def container_path(self, container=None):
+        if container is None:
+            container = self.rng.randrange(self.args.containers)
+        return "/%s/%s/%s/c%d" % (DRIVE, PARTITION, ACCOUNT, container)
+
+    def next_request(self):
+        """
+        Returns a tuple of (label, method, path, headers, body) for a request
+        chosen at random from the mix.
+        """
+        point = self.rng.uniform(0, self.cum_weights[-1])
+        for op, cum_weight in zip(self.ops, self.cum_weights):
+            if point <= cum_weight:
+                break
+        return getattr(self, "make_" + op)()
+
+    def make_container_put(self, container=None):
+        headers = {
+            "X-Timestamp": Timestamp.now().internal,
+            "X-Account-Host": self.account_host,
+            "X-Account-Partition": PARTITION,
+            "X-Account-Device": DRIVE,
+        }
+        return "PUT.container", "PUT", self.container_path(container), headers, b""
+
+    def make_object_put(self):
+        headers = {
+            "X-Timestamp": Timestamp.now().internal,
+            "X-Size": "1024",
+            "X-Content-Type": "application/octet-stream",
+            "X-Etag": "d41d8cd98f00b204e9800998ecf8427e",
+        }
+        path = self.container_path() + "/" + object_name(self.rng, self.args)
+        return "PUT.object", "PUT", path, headers, b""
+
+    def make_object_delete(self):
+        headers = {"X-Timestamp": Timestamp.now().internal}
+        path = self.container_path() + "/" + object_name(self.rng, self.args)
+        return "DELETE.object", "DELETE", path, headers, b""
+
+    def make_head(self):
+        return "HEAD", "HEAD", self.container_path(), {}, b""
+
+    def make_listing(self):
+        params = ["format=json", "limit=%d" % self.args.limit]
+        if self.rng.random() < 0.5:
+            params.append("prefix=dir%02d/" % self.rng.randrange(self.args.dirs))
+        if self.rng.random() < 0.5:
+            params.append("delimiter=/")
+        path = self.container_path() + "?" + "&".join(params)
+        return "GET.listing", "GET", path, {}, b""
+
+    def make_update(self):
+        timestamp = Timestamp.now().internal
+        records = [
+            object_record(
+                object_name(self.rng, self.args),
+                timestamp,
+                deleted=int(self.rng.random() < 0.2),
+            )
+            for _ in range(self.args.update_batch)
+        ]
+        headers = {"X-Timestamp": timestamp, "Content-Type": "application/json"}
+        body = json.dumps(records).encode("ascii")
+        return "UPDATE", "UPDATE", self.container_path(), headers, body
+
+    def make_shard_put(self):
+        timestamp = Timestamp.now()
+        bounds = sorted(
+            "dir%02d/" % d
+            for d in self.rng.sample(range(self.args.dirs), min(self.args.dirs, 3))
+        )
+        container = self.rng.randrange(self.args.containers)
+        shard_ranges = [
+            dict(
+                ShardRange(
+                    ".shards_%s/c%d-%d" % (ACCOUNT, container, i),
+                    timestamp,
+                    lower,
+                    upper,
+                    state=ShardRange.FOUND,
+                )
+            )
+            for i, (lower, upper) in enumerate(zip([""] + bounds, bounds + [""]))
+        ]
+        headers = {
+            "X-Timestamp": timestamp.internal,
+            "X-Backend-Record-Type": "shard",
+            "Content-Type": "application/json",
+        }
+        body = json.dumps(shard_ranges).encode("ascii")
+        return "PUT.shard", "PUT", self.container_path(container), headers, body
+
+
+class InProcessClient(object):
+    """
+    Sends requests directly to a WSGI app.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, method, path, headers, body):
+        req = Request.blank(
+            path, environ={"REQUEST_METHOD": method}, headers=headers, body=body
+        )
+        resp = req.get_response(self.app)
+        b"".join(resp.app_iter)
+        return resp.status_int
+
+
+class HTTPClient(object):
+    """
+    Sends requests to a server over HTTP.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def request(self, method, path, headers, body):
+        drive, part, rest = path.lstrip("/").split("/", 2)
+        rest, _sep, query = rest.partition("?")
+        headers = dict(headers, **{"Content-Length": str(len(body))})
+        conn = http_connect(
+            self.host,
+            self.port,
+            drive,
+            part,
+            method,
+            "/" + rest,
+            headers=headers,
+            query_string=query or None,
+        )
+        if body:
+            conn.send(body)
+        resp = conn.getresponse()
+        resp.read()
+        conn.close()
+        return resp.status
+
+
+def stub_account_server(env, start_response):
+    """
+    A WSGI app that accepts every request, standing in for account servers.
+    """
+    if env.get("wsgi.input"):
+        env["wsgi.input"].read()
+    start_response("204 No Content", [("Content-Length", "0")])
+    return [b""]
+
+
+def start_server(app):
+    """
+    Serves a WSGI app on an ephemeral local port.
+
+    :return: a tuple of the server's (host, port) and its greenthread
+    """
+    sock = eventlet.listen(("127.0.0.1", 0))
+    thread = eventlet.spawn(
+        eventlet.wsgi.server, sock, app, log_output=False, max_size=4096
+    )
+    return sock.getsockname()[:2], thread
+
+
+def run_level(client, workload, concurrency, num_requests):
+    """
+    Send ``num_requests`` requests from ``concurrency`` greenthreads.
+
+    :return: a list of result dicts, one for each request label and one with
+        the label ``all``
+    """
+    timings = {}
+    errors = {}
+
+    def do_request(request):
+        label, method, path, headers, body = request
+        start = time.time()
+        try:
+            status = client.request(method, path, headers, body)
+        except Exception:
+            status = None
+        elapsed = (time.time() - start) * 1000
+        timings.setdefault(label, []).append(elapsed)
+        if status is None or not 200 <= status < 300:
+            errors[label] = errors.get(label, 0) + 1
+
+    requests = [workload.next_request() for _ in range(num_requests)]
+    pool = GreenPool(concurrency)
+    start = time.time()
+    for request in requests:
+        pool.spawn_n(do_request, request)
+    pool.waitall()
+    elapsed = time.time() - start
+
+    timings["all"] = [t for label_timings in timings.values() for t in label_timings]
+    errors["all"] = sum(errors.values())
+    results = []
+    for label, label_timings in sorted(timings.items()):
+        label_timings.sort()
+        results.append(
+            {
+                "concurrency": concurrency,
+                "method": label,
+                "requests": len(label_timings),
+                "errors": errors.get(label, 0),
+                "rps": len(label_timings) / elapsed if elapsed else None,
+                "p50_ms": percentile(label_timings, 50),
+                "p99_ms": percentile(label_timings, 99),
+            }
+        )
+    return results
+
+
+def parse_mix(value):
+    """
+    Parse a request mix given as ``op=weight,op=weight``.
+    """
+    valid_ops = [op for op, _weight in DEFAULT_MIX]
+    mix = []
+    for item in value.split(","):
+        op, _sep, weight = item.partition("=")
+        op = op.strip()
+        if op not in valid_ops:
+            raise argparse.ArgumentTypeError(
+                "unknown operation %r, expected one of %s" % (op, ", ".join(valid_ops))
+            )
+        try:
+            mix.append((op, float(weight)))
+        except ValueError:
+            raise argparse.ArgumentTypeError("invalid weight for %s" % op)
+    return mix
+
+
+def parse_conf_option(value):
+    key, sep, conf_value = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError("expected key=value, got %r" % value)
+    return key.strip(), conf_value.strip()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Drive a container server with a mix of requests at "
+        "increasing concurrency; requests per second and latency "
+        "percentiles per request type are written to stdout as one JSON "
+        "object per line."
+    )
+    parser.add_argument(
+        "--http",
+        action="store_true",
+        help="send requests over HTTP to a local server rather than calling "
+        "the WSGI app directly",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16, 64],
+        help="numbers of concurrent requests",
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=2000,
+        help="number of requests sent at each concurrency",
+    )
+    parser.add_argument(
+        "--containers", type=int, default=10, help="number of containers"
+    )
+    parser.add_argument(
+        "--objects-per-container",
+        type=int,
+        default=10000,
+        help="number of distinct object names in each container",
+    )
+    parser.add_argument(
+        "--dirs",
+        type=int,
+        default=100,
+        help="number of pseudo-directories in each container",
+    )
+    parser.add_argument(
+        "--prefill",
+        type=int,
+        default=1000,
+        help="number of objects added to each container before the run",
+    )
+    parser.add_argument(
+        "--update-batch",
+        type=int,
+        default=100,
+        help="number of object records in each UPDATE request",
+    )
+    parser.add_argument(
+        "--limit", type=int, default=1000, help="listing limit of each GET"
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=list(DEFAULT_MIX),
+        help="comma separated op=weight pairs; ops are %s"
+        % ", ".join(op for op, _weight in DEFAULT_MIX),
+    )
+    parser.add_argument(
+        "--set",
+        type=parse_conf_option,
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="container server config option; may be given more than once",
+    )
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    parser.add_argument(
+        "--tmpdir", default=None, help="directory in which to create devices"
+    )
+    args = parser.parse_args(args)
+
+    devices = tempfile.mkdtemp(dir=args.tmpdir)
+    try:
+        os.mkdir(os.path.join(devices, DRIVE))
+        conf = {"devices": devices, "mount_check": "false", "log_requests": "false"}
+        conf.update(args.set)
+        app = app_factory({}, **conf)
+        account_addr, account_thread = start_server(stub_account_server)
+        if args.http:
+            server_addr, server_thread = start_server(app)
+            client = HTTPClient(*server_addr)
+        else:
+            server_thread = None
+            client = InProcessClient(app)
+
+        workload = Workload(args, account_addr, seed=args.seed)
+        for container in range(args.containers):
+            _label, method, path, headers, body = workload.make_container_put(container)
+            client.request(method, path, headers, body)
+            for _ in range(0, args.prefill, args.update_batch):
+                _label, method, _path, headers, body = workload.make_update()
+                client.request(method, path, headers, body)
+
+        for concurrency in args.concurrency:
+            for result in run_level(client, workload, concurrency, args.requests):
+                sys.stdout.write(json.dumps(result) + "\n")
+                sys.stdout.flush()
+
+        account_thread.kill()
+        if server_thread:
+            server_thread.kill()
+    finally:
+        shutil.rmtree(devices, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Bloom filters of the object names in container DBs.
+"""
+
+import collections
+import hashlib
+import json
+import math
+import os
+import struct
+import tempfile
+
+import six
+
+
+class NameFilter(object):
+    """
+    A Bloom filter of the object names in a container DB.
+
+    A filter never reports that a name it holds is absent, but may report
+    that an absent name might be present. The filter covers the rows of the
+    DB's object table up to ``covered_rowid``; the object table's ROWIDs are
+    never reused, so the filter can be brought up to date by adding the
+    names of rows with greater ROWIDs.
+
+    :param capacity: the number of names the filter is sized for; the false
+        positive rate grows once more names than this have been added
+    :param db_id: the id of the DB whose names the filter holds
+    :param bits_per_name: the number of bits per name of capacity
+    """
+
+    def __init__(self, capacity, db_id, bits_per_name=10):
+        self.capacity = capacity
+        self.db_id = db_id
+        self.num_bits = max(capacity * bits_per_name // 8, 1) * 8
+        self.num_hashes = max(int(round(bits_per_name * math.log(2))), 1)
+        self.bits = bytearray(self.num_bits // 8)
+        #: the greatest object table ROWID whose name has been added
+        self.covered_rowid = 0
+        #: the number of distinct names added, give or take false positives
+        self.count = 0
+        #: the number of names checked with :meth:`might_contain`
+        self.checks = 0
+        #: the number of checked names that might be present
+        self.maybes = 0
+        self.dirty = False
+        self.last_save = 0
+
+    def indexes(self, name):
+        """
+        Returns the bit indexes of a name, which may be passed to
+        :meth:`add` and :meth:`might_contain` to avoid hashing the name again.
+        """
+        if isinstance(name, six.text_type):
+            name = name.encode("utf-8")
+        h1, h2 = struct.unpack("<QQ", hashlib.md5(name).digest())
+        h2 |= 1
+        num_bits = self.num_bits
+        return [(h1 + i * h2) % num_bits for i in range(self.num_hashes)]
+
+    def add(self, name, indexes=None):
+        bits = self.bits
+        new = False
+        for index in indexes or self.indexes(name):
+            mask = 1 << (index & 7)
+            if not bits[index >> 3] & mask:
+                bits[index >> 3] |= mask
+                new = True
+        if new:
+            # names that are added again, for example when an object is
+            # updated, are not counted
+            self.count += 1
+            self.dirty = True
+
+    def might_contain(self, name, indexes=None):
+        """
+        Returns False if the name is definitely not in the filter, otherwise
+        True.
+        """
+        self.checks += 1
+        bits = self.bits
+        for index in indexes or self.indexes(name):
+            if not bits[index >> 3] & (1 << (index & 7)):
+                return False
+        self.maybes += 1
+        return True
+
+    @property
+    def full(self):
+        return self.count > self.capacity
+
+    def estimated_false_positive_rate(self):
+        """
+        Returns the expected false positive rate for the names added so far.
+        """
+        return (
+            1 - math.exp(-float(self.num_hashes) * self.count / self.num_bits)
+        ) ** self.num_hashes
+
+    def save(self, path):
+        """
+        Atomically write the filter to a file.
+        """
+        header = {
+            "capacity": self.capacity,
+            "db_id": self.db_id,
+            "num_bits": self.num_bits,
+            "num_hashes": self.num_hashes,
+            "covered_rowid": self.covered_rowid,
+            "count": self.count,
+        }
+        # copy the bits with the header, in case names are added while the
+        # file is written
+        bits = bytes(self.bits)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(json.dumps(header).encode("ascii") + b"\n")
+                fp.write(bits)
+            os.rename(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a filter from a file written by :meth:`save`.
+
+        :returns: a NameFilter, or None if the file is missing or invalid
+        """
+        try:
+            with open(path, "rb") as fp:
+                header = json.loads(fp.readline().decode("ascii"))
+                bits = fp.read()
+            name_filter = cls(header["capacity"], header["db_id"])
+            if (
+                name_filter.num_bits != header["num_bits"]
+                or name_filter.num_hashes != header["num_hashes"]
+                or len(bits) != name_filter.num_bits // 8
+            ):
+                return None
+            name_filter.bits = bytearray(bits)
+            name_filter.covered_rowid = header["covered_rowid"]
+            name_filter.count = header["count"]
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            # the filter is rebuilt from the DB
+            return None
+        return name_filter
+
+
+class NameFilterCache(object):
+    """
+    The name filters held in memory, keyed by the paths of their files.
+
+    Filters are evicted, least recently used first, once their bits take more
+    than ``max_bytes`` in total.
+
+    :param max_bytes: the most bytes of filter bits held
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        #: maps name filter file path -> NameFilter, least recently used first
+        self.filters = collections.OrderedDict()
+        #: the total bytes of the bits of the filters held
+        self.size = 0
+
+    def get(self, path):
+        """
+        Returns the filter cached for a path, or None.
+        """
+        return self.filters.get(path)
+
+    def pop(self, path):
+        """
+        Remove the filter cached for a path.
+
+        :returns: the filter, or None if there was none
+        """
+        name_filter = self.filters.pop(path, None)
+        if name_filter is not None:
+            self.size -= len(name_filter.bits)
+        return name_filter
+
+    def put(self, path, name_filter):
+        """
+        Cache a filter as the most recently used, evicting the least recently
+        used filters, possibly including this one, until the cache is within
+        ``max_bytes``.
+        """
+        self.pop(path)
+        self.filters[path] = name_filter
+        self.size += len(name_filter.bits)
+        while self.size > self.max_bytes:
+            self.pop(next(iter(self.filters)))
@@ -0,0 +1,143 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Sampling profiler for container server requests.
+"""
+
+import cProfile
+import os
+import pstats
+import time
+
+from swift.common.utils import mkdirs
+
+
+def size_bucket(object_count):
+    """
+    Returns a label for the order of magnitude of a container's object count,
+    e.g. ``1e3`` for containers with 100 to 999 objects.
+    """
+    return "1e%d" % len(str(max(int(object_count), 0)))
+
+
+class RequestProfiler(object):
+    """
+    Profiles one in every ``sample_every`` requests with cProfile and
+    aggregates the results by tag.
+
+    Only one request is profiled at a time. Note that greenthreads share the
+    profiled thread, so a profile also includes any work done by other
+    requests while the profiled request is waiting.
+
+    :param sample_every: profile one in this many requests
+    :param profile_dir: if set, a directory to which aggregated results are
+        periodically written, one pstats file per tag
+    :param dump_interval: minimum number of seconds between writes of
+        aggregated results to ``profile_dir``
+    :param logger: a logger instance
+    """
+
+    def __init__(self, sample_every, profile_dir=None, dump_interval=60, logger=None):
+        self.sample_every = sample_every
+        self.profile_dir = profile_dir
+        self.dump_interval = dump_interval
+        self.logger = logger
+        self.stats = {}
+        self.counts = {}
+        self.requests_seen = 0
+        self.profiling = False
+        self.last_dump = time.time()
+
+    def should_profile(self):
+        """
+        Returns True if the next request should be profiled.
+        """
+        self.requests_seen += 1
+        return not self.profiling and self.requests_seen % self.sample_every == 0
+
+    def start(self):
+        """
+        Starts profiling a request.
+
+        :returns: a cProfile.Profile instance that must be passed to
+            :meth:`stop`
+        """
+        self.profiling = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def stop(self, profile, tag):
+        """
+        Stops profiling a request and aggregates its profile.
+
+        :param profile: the profile returned by :meth:`start`
+        :param tag: a string that identifies the kind of request
+        """
+        profile.disable()
+        self.profiling = False
+        if tag in self.stats:
+            self.stats[tag].add(profile)
+        else:
+            self.stats[tag] = pstats.Stats(profile)
+        self.counts[tag] = self.counts.get(tag, 0) + 1
+        if self.profile_dir and time.time() - self.last_dump >= self.dump_interval:
+            self.dump()
+
+    def dump(self):
+        """
+        Write the aggregated results to ``profile_dir``.
+        """
+        self.last_dump = time.time()
+        try:
+            mkdirs(self.profile_dir)
+            for tag, stats in self.stats.items():
+                stats.dump_stats(
+                    os.path.join(
+                        self.profile_dir,
+                        "container-server.%d.%s.prof" % (os.getpid(), tag),
+                    )
+                )
+        except (OSError, IOError) as err:
+            if self.logger:
+                self.logger.error("Unable to write profiles: %s", err)
+
+    def summary(self, limit=20):
+        """
+        Returns a JSON-serialisable summary of the aggregated results.
+
+        :param limit: the number of functions with the most cumulative time
+            to list for each tag
+        :returns: a dict mapping each tag to a dict with the number of
+            ``requests`` profiled and the ``top`` functions, most cumulative
+            time first
+        """
+        summary = {}
+        for tag, stats in self.stats.items():
+            top = sorted(stats.stats.items(), key=lambda item: -item[1][3])
+            summary[tag] = {
+                "requests": self.counts[tag],
+                "top": [
+                    {
+                        "function": "%s:%d(%s)" % func,
+                        "ncalls": ncalls,
+                        "tottime": tottime,
+                        "cumtime": cumtime,
+                    }
+                    for func, (_cc, ncalls, tottime, cumtime, _callers) in top[:limit]
+                ],
+            }
+        return summary
@@ -0,0 +1,163 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Priority scheduling of container server requests.
+"""
+
+import collections
+import time
+
+from eventlet.event import Event
+
+
+class RequestClass(object):
+    """
+    The limits and counters of one class of requests.
+
+    :param name: the name of the class
+    :param max_running: the most requests of the class handled at once
+    :param max_queued: the most requests of the class waiting to be handled;
+        further requests are shed
+    """
+
+    def __init__(self, name, max_running, max_queued):
+        self.name = name
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.running = 0
+        #: the Events of the waiting requests, first come first
+        self.waiters = collections.deque()
+        self.admitted = 0
+        self.shed = 0
+        #: the total time that admitted requests waited, in seconds
+        self.wait_time = 0.0
+
+    def stats(self):
+        return {
+            "max_running": self.max_running,
+            "max_queued": self.max_queued,
+            "running": self.running,
+            "queued": len(self.waiters),
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "wait_time": self.wait_time,
+        }
+
+
+class RequestScheduler(object):
+    """
+    Admits requests to be handled, at most ``max_concurrency`` at once.
+
+    Each request belongs to a class. Classes are given in priority order,
+    highest first; whenever a request completes, the waiting request of the
+    highest priority class that is below its own ``max_running`` limit is
+    admitted next. A request whose class already has ``max_queued`` waiting
+    requests is shed.
+
+    :param max_concurrency: the most requests of all classes handled at once
+    :param classes: a list of :class:`RequestClass`, highest priority first
+    :param retry_after: the number of seconds after which shed requests may
+        be retried
+    """
+
+    def __init__(self, max_concurrency, classes, retry_after=1):
+        self.max_concurrency = max_concurrency
+        self.classes = collections.OrderedDict(
+            (request_class.name, request_class) for request_class in classes
+        )
+        self.retry_after = retry_after
+        self.running = 0
+
+    def _can_run(self, request_class):
+        return (
+            self.running < self.max_concurrency
+            and request_class.running < request_class.max_running
+        )
+
+    def _has_priority_waiters(self, request_class):
+        """
+        Returns True if any request of the same or a higher priority class
+        is waiting and could be admitted in its place.
+        """
+        for other in self.classes.values():
+            if other.waiters and other.running < other.max_running:
+                return True
+            if other is request_class:
+                return False
+        return False
+
+    def acquire(self, name):
+        """
+        Wait until a request of a class may be handled.
+
+        :param name: the name of the request's class
+        :returns: True if the request may now be handled, in which case
+            :meth:`release` must be called once it has been; False if the
+            request has been shed
+        """
+        request_class = self.classes[name]
+        if self._can_run(request_class) and not self._has_priority_waiters(
+            request_class
+        ):
+            self._admit(request_class)
+            return True
+        if len(request_class.waiters) >= request_class.max_queued:
+            request_class.shed += 1
+            return False
+        start = time.time()
+        event = Event()
+        request_class.waiters.append(event)
+        # the request is admitted, and counted, by the request that sends
+        # the event
+        try:
+            event.wait()
+        except BaseException:
+            if event.ready():
+                self.release(name)
+            else:
+                request_class.waiters.remove(event)
+            raise
+        request_class.wait_time += time.time() - start
+        return True
+
+    def release(self, name):
+        """
+        Complete the handling of a request, admitting waiting requests in
+        its place.
+
+        :param name: the name of the request's class
+        """
+        request_class = self.classes[name]
+        request_class.running -= 1
+        self.running -= 1
+        for request_class in self.classes.values():
+            while request_class.waiters and self._can_run(request_class):
+                self._admit(request_class)
+                request_class.waiters.popleft().send()
+
+    def _admit(self, request_class):
+        request_class.running += 1
+        request_class.admitted += 1
+        self.running += 1
+
+    def stats(self):
+        """
+        Returns a dict mapping each class's name to a dict of its counters.
+        """
+        return dict(
+            (name, request_class.stats())
+            for name, request_class in self.classes.items()
+        )
@@ -13,18 +13,35 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import codecs
+import collections
+import functools
 import json
 import os
+import random
+import threading
 import time
 import traceback
 import math
+import zlib
+from contextlib import contextmanager
 
-from eventlet import Timeout
+from eventlet import GreenPile, Timeout, sleep, spawn
 
 import six
 from six.moves.urllib.parse import quote
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 import swift.common.db
+from swift.container import timestamps
 from swift.container.sync_store import ContainerSyncStore
 from swift.container.backend import (
     ContainerBroker,
@@ -34,11 +51,18 @@ from swift.container.backend import (
     SHARDING,
     SHARDED,
     SHARD_UPDATE_STATES,
+    parse_tuning_conf,
 )
+from swift.container.executors import DriveExecutors, ExecutorQueueFull
+from swift.container.hot_containers import HotContainers
+from swift.container.name_filter import NameFilterCache
+from swift.container.profiling import RequestProfiler, size_bucket
+from swift.container.scheduler import RequestClass, RequestScheduler
 from swift.container.replicator import ContainerReplicatorRpc
 from swift.common.db import DatabaseAlreadyExists
 from swift.common.container_sync_realms import ContainerSyncRealms
 from swift.common.request_helpers import (
+    get_param,
     split_and_validate_path,
     is_sys_or_user_meta,
     validate_internal_container,
@@ -61,6 +85,8 @@ from swift.common.utils import (
     fs_has_free_space,
     list_from_csv,
     ShardRange,
+    get_db_files,
+    split_path,
 )
 from swift.common.constraints import (
     valid_timestamp,
@@ -85,6 +111,8 @@ from swift.common.swob import (
     HTTPNotFound,
     HTTPPreconditionFailed,
     HTTPMethodNotAllowed,
+    HTTPRequestEntityTooLarge,
+    HTTPServiceUnavailable,
     Request,
     Response,
     HTTPInsufficientStorage,
@@ -94,6 +122,101 @@ from swift.common.swob import (
     str_to_wsgi,
 )
 
+#: The most db dirs for which ContainerController.db_exists results are cached.
+DB_EXISTS_CACHE_SIZE = 100000
+
+#: The keys of an object record sent to UPDATE as a positional array.
+UPDATE_RECORD_KEYS = (
+    "name",
+    "created_at",
+    "size",
+    "content_type",
+    "etag",
+    "deleted",
+    "storage_policy_index",
+    "ctype_timestamp",
+    "meta_timestamp",
+)
+
+#: The number of leading :data:`UPDATE_RECORD_KEYS` that every object record
+#: sent to UPDATE must have.
+UPDATE_RECORD_REQUIRED_KEYS = 6
+
+#: The longest line of an application/x-ndjson UPDATE body.
+MAX_UPDATE_LINE_LENGTH = 65536
+
+#: REPLICATE RPCs whose first argument, a list, is merged in batches as the
+#: request body is decoded.
+STREAMED_REPLICATE_OPS = ("merge_items", "merge_shard_ranges")
+
+#: The request methods sampled by the profiler.
+PROFILED_METHODS = ("GET", "PUT", "UPDATE", "REPLICATE")
+
+#: The path at which a summary of the profiler's results is served.
+PROFILE_RECON_PATH = "/recon/profile"
+
+#: The path at which the stats of the drives' tpool executors are served,
+#: when they are enabled.
+TPOOL_RECON_PATH = "/recon/tpool"
+
+#: The path at which the hot containers are served, when they are tracked.
+HOT_CONTAINERS_RECON_PATH = "/recon/hot_containers"
+
+#: The path at which the request scheduler's counters are served, when
+#: scheduling is enabled.
+SCHEDULER_RECON_PATH = "/recon/scheduler"
+
+#: The paths of the recon endpoints served by :meth:`ContainerController._recon`.
+RECON_PATHS = (
+    PROFILE_RECON_PATH,
+    TPOOL_RECON_PATH,
+    HOT_CONTAINERS_RECON_PATH,
+    SCHEDULER_RECON_PATH,
+)
+
+#: Maps request methods to the scheduling classes of their requests.
+REQUEST_CLASSES = {
+    "GET": "read",
+    "HEAD": "read",
+    "INFO": "read",
+    "PUT": "update",
+    "POST": "update",
+    "DELETE": "update",
+    "UPDATE": "update",
+    "REPLICATE": "replication",
+}
+
+#: The scheduling classes, highest priority first, with their default
+#: limits on running and queued requests as fractions of the
+#: ``scheduler_max_concurrency`` option.
+SCHEDULER_CLASSES = (
+    ("read", 1.0, 64.0),
+    ("update", 1.0, 8.0),
+    ("replication", 0.25, 1.0),
+    ("long_poll", 0.25, 1.0),
+)
+
+#: The scheduling class of changes feed requests that wait for rows, which
+#: would otherwise hold a read slot while they sleep.
+LONG_POLL_CLASS = "long_poll"
+
+#: The keys of the object rows in a changes feed, in the order of the row
+#: tuples yielded by ContainerBroker.export_objects.
+CHANGES_KEYS = (
+    "name",
+    "created_at",
+    "size",
+    "content_type",
+    "etag",
+    "deleted",
+    "storage_policy_index",
+    "ROWID",
+)
+
+#: The number of rows of a changes feed response encoded into each chunk of
+#: its body.
+CHANGES_CHUNK_ROWS = 100
+
 
 def gen_resp_headers(info, is_deleted=False):
     """
@@ -101,14 +224,14 @@ def gen_resp_headers(info, is_deleted=False):
     """
     # backend headers are always included
     headers = {
-        "X-Backend-Timestamp": Timestamp(info.get("created_at", 0)).internal,
-        "X-Backend-PUT-Timestamp": Timestamp(info.get("put_timestamp", 0)).internal,
-        "X-Backend-DELETE-Timestamp": Timestamp(
+        "X-Backend-Timestamp": timestamps.internal(info.get("created_at", 0)),
+        "X-Backend-PUT-Timestamp": timestamps.internal(info.get("put_timestamp", 0)),
+        "X-Backend-DELETE-Timestamp": timestamps.internal(
             info.get("delete_timestamp", 0)
-        ).internal,
-        "X-Backend-Status-Changed-At": Timestamp(
+        ),
+        "X-Backend-Status-Changed-At": timestamps.internal(
             info.get("status_changed_at", 0)
-        ).internal,
+        ),
         "X-Backend-Storage-Policy-Index": info.get("storage_policy_index", 0),
     }
     if not is_deleted:
@@ -117,8 +240,8 @@ def gen_resp_headers(info, is_deleted=False):
             {
                 "X-Container-Object-Count": info.get("object_count", 0),
                 "X-Container-Bytes-Used": info.get("bytes_used", 0),
-                "X-Timestamp": Timestamp(info.get("created_at", 0)).normal,
-                "X-PUT-Timestamp": Timestamp(info.get("put_timestamp", 0)).normal,
+                "X-Timestamp": timestamps.normal(info.get("created_at", 0)),
+                "X-PUT-Timestamp": timestamps.normal(info.get("put_timestamp", 0)),
                 "X-Backend-Sharding-State": info.get("db_state", UNSHARDED),
             }
         )
@@ -151,6 +274,241 @@ def get_obj_name_and_placement(req):
     return drive, part, account, container, obj
 
 
+class PhaseTimer(object):
+    """
+    Accumulates the time spent in named phases of a request.
+
+    Phases may be nested, in which case the time spent in an inner phase is
+    not also counted as time spent in the outer phase.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.phases = {}
+        self._nested = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self.phases[name] = (
+                self.phases.get(name, 0.0) + elapsed - self._nested.pop()
+            )
+            if self._nested:
+                self._nested[-1] += elapsed
+
+
+class PhaseTimedIter(object):
+    """
+    Wraps a response's app_iter so that sending the response body is timed as
+    a phase of the request, and calls a function once the body has been sent
+    or the app_iter has been closed.
+
+    :param app_iter: the response's app_iter
+    :param timer: the request's PhaseTimer
+    :param name: the name of the phase
+    :param on_close: a function called without arguments when the app_iter is
+        closed
+    """
+
+    def __init__(self, app_iter, timer, name, on_close):
+        self.app_iter = app_iter
+        self.timer = timer
+        self.name = name
+        self.on_close = on_close
+        self.closed = False
+        self._iter = self._timed_iter()
+
+    def _timed_iter(self):
+        # the phase includes the time the server spends writing each chunk
+        with self.timer.phase(self.name):
+            for chunk in self.app_iter:
+                yield chunk
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iter)
+
+    next = __next__
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._iter.close()
+            if hasattr(self.app_iter, "close"):
+                self.app_iter.close()
+        finally:
+            self.on_close()
+
+
+def timed_phase(name):
+    """
+    Decorator to time a ContainerController method as a phase of the current
+    request, if the request is being timed.
+
+    :param name: the name of the phase
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapped(self, *args, **kwargs):
+            timer = getattr(self._request_local, "phase_timer", None)
+            if timer is None:
+                return func(self, *args, **kwargs)
+            with timer.phase(name):
+                return func(self, *args, **kwargs)
+
+        return wrapped
+
+    return decorator
+
+
+class DecompressingReader(object):
+    """
+    A file-like wrapper that decompresses a deflate or gzip encoded stream as
+    it is read.
+
+    :param fp: the file-like object to read the compressed stream from
+    :param chunk_size: the size of reads from ``fp``
+    """
+
+    def __init__(self, fp, chunk_size=65536):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        # accept either a zlib or a gzip header
+        self.decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        self.eof = False
+
+    def read(self, size=-1):
+        chunks = []
+        while not self.eof and (size < 0 or not chunks):
+            data = self.decompressor.unconsumed_tail
+            if not data:
+                data = self.fp.read(self.chunk_size)
+                if not data:
+                    self.eof = True
+                    chunks.append(self.decompressor.flush())
+                    if not self.decompressor.eof:
+                        raise ValueError("Truncated compressed body")
+                    break
+            chunk = self.decompressor.decompress(
+                data, size if size > 0 else self.chunk_size
+            )
+            if chunk:
+                chunks.append(chunk)
+        return b"".join(chunks)
+
+
+class JSONStreamReader(object):
+    """
+    Incrementally decodes JSON from a file-like object, so that the elements
+    of large arrays can be consumed as they are read.
+
+    :param fp: the file-like object to read utf-8 encoded JSON from
+    :param chunk_size: the size of reads from ``fp``
+    """
+
+    def __init__(self, fp, chunk_size=65536):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        # one entry per open array, True until its first element is read
+        self.arrays = []
+
+    def _read(self):
+        if self.eof:
+            return False
+        data = self.fp.read(self.chunk_size)
+        self.eof = not data
+        text = self.text_decoder.decode(data, final=self.eof)
+        self.buf = self.buf[self.pos :] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Returns the next non-whitespace character, or the empty string at the
+        end of the stream.
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._read():
+                return ""
+
+    def _expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Expected %r" % char)
+        self.pos += 1
+
+    def start_array(self):
+        """
+        Consumes the start of an array.
+
+        :raises ValueError: if the next value is not an array
+        """
+        self._expect("[")
+        self.arrays.append(True)
+
+    def next_element(self):
+        """
+        Moves to the next element of the innermost open array.
+
+        :returns: True if there is another element to read, False if the end
+            of the array has been consumed
+        :raises ValueError: if the array is badly formed
+        """
+        if self.peek() == "]":
+            self.pos += 1
+            self.arrays.pop()
+            return False
+        if not self.arrays[-1]:
+            self._expect(",")
+        self.arrays[-1] = False
+        return True
+
+    def value(self):
+        """
+        Decodes and returns the next value.
+
+        :raises ValueError: if the next value is not valid JSON
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self._read():
+                    continue
+                raise
+            # a number at the end of the buffer may not be complete
+            if end == len(self.buf) and self._read():
+                continue
+            self.pos = end
+            return value
+
+    def end(self):
+        """
+        :raises ValueError: if anything other than whitespace remains
+        """
+        if self.peek():
+            raise ValueError("Extra data after JSON value")
+
+
 class ContainerController(BaseStorageServer):
     """WSGI Controller for the container server."""
 
@@ -185,9 +543,6 @@ class ContainerController(BaseStorageServer):
             for h in conf.get("allowed_sync_hosts", "127.0.0.1").split(",")
             if h.strip()
         ]
-        self.replicator_rpc = ContainerReplicatorRpc(
-            self.root, DATADIR, ContainerBroker, self.mount_check, logger=self.logger
-        )
         if conf.get("auto_create_account_prefix"):
             self.logger.warning(
                 "Option auto_create_account_prefix is "
@@ -216,11 +571,133 @@ class ContainerController(BaseStorageServer):
         swift.common.db.QUERY_LOGGING = config_true_value(
             conf.get("db_query_logging", "f")
         )
+        tpool_threads_per_drive = int(conf.get("tpool_threads_per_drive", 0))
+        if tpool_threads_per_drive > 0:
+            self.drive_executors = DriveExecutors(
+                tpool_threads_per_drive,
+                int(conf.get("tpool_max_queue_per_drive", 64)),
+            )
+        else:
+            self.drive_executors = None
+        self.tpool_retry_after = int(conf.get("tpool_retry_after", 1))
+        #: keyword arguments for every ContainerBroker made by the server,
+        #: including those of the replicator RPC
+        self.broker_options = {
+            "drive_executors": self.drive_executors,
+            "tuning_profiles": (
+                parse_tuning_conf(conf)
+                if config_true_value(conf.get("db_tuning", "f"))
+                else None
+            ),
+            "tuning_tiny_max_rows": int(conf.get("db_tiny_max_rows", 10000)),
+            "tuning_huge_min_rows": int(conf.get("db_huge_min_rows", 1000000)),
+            "name_filters": (
+                NameFilterCache(
+                    int(conf.get("db_name_filter_cache_bytes", 256 * 1024 * 1024))
+                )
+                if config_true_value(conf.get("db_name_filters", "f"))
+                else None
+            ),
+            "name_filter_min_rows": int(conf.get("db_name_filter_min_rows", 10000)),
+            "name_filter_max_rows": int(conf.get("db_name_filter_max_rows", 10000000)),
+            "prefix_stats_cache_depth": int(conf.get("prefix_stats_cache_depth", 2)),
+            "query_stats": config_true_value(conf.get("db_query_stats", "f")),
+        }
+        self.replicator_rpc = ContainerReplicatorRpc(
+            self.root,
+            DATADIR,
+            functools.partial(ContainerBroker, **self.broker_options),
+            self.mount_check,
+            logger=self.logger,
+        )
+        self.tpool_listings = config_true_value(conf.get("tpool_listings", "f"))
+        scheduler_max_concurrency = int(conf.get("scheduler_max_concurrency", 0))
+        if scheduler_max_concurrency > 0:
+            request_classes = []
+            for name, running, queued in SCHEDULER_CLASSES:
+                max_running = conf.get(
+                    "scheduler_%s_max_running" % name,
+                    max(int(scheduler_max_concurrency * running), 1),
+                )
+                max_queued = conf.get(
+                    "scheduler_%s_max_queued" % name,
+                    int(scheduler_max_concurrency * queued),
+                )
+                request_classes.append(
+                    RequestClass(name, int(max_running), int(max_queued))
+                )
+            self.scheduler = RequestScheduler(
+                scheduler_max_concurrency,
+                request_classes,
+                retry_after=int(conf.get("scheduler_retry_after", 1)),
+            )
+        else:
+            self.scheduler = None
+        hot_containers_capacity = int(conf.get("hot_containers_capacity", 0))
+        if hot_containers_capacity > 0:
+            self.hot_containers = HotContainers(
+                hot_containers_capacity,
+                interval=float(conf.get("hot_containers_interval", 300)),
+                top=int(conf.get("hot_containers_top", 10)),
+                logger=self.logger,
+            )
+        else:
+            self.hot_containers = None
         self.sync_store = ContainerSyncStore(self.root, self.logger, self.mount_check)
         self.fallocate_reserve, self.fallocate_is_percent = config_fallocate_value(
             conf.get("fallocate_reserve", "1%")
         )
+        self.free_space_check_interval = float(conf.get("free_space_check_interval", 1))
+        self.free_space_check_bytes = int(
+            conf.get("free_space_check_bytes", 64 * 1024 * 1024)
+        )
+        #: maps drive -> [time of last passed check, bytes that may still be
+        #: written before the next check]
+        self._free_space_cache = {}
+        self.drive_check_interval = float(conf.get("drive_check_interval", 0))
+        self.merged_sharding_listings = config_true_value(
+            conf.get("merged_sharding_listings", "false")
+        )
+        self.prefix_stats = config_true_value(conf.get("prefix_stats", "false"))
+        self.changes_feed = config_true_value(conf.get("changes_feed", "false"))
+        self.changes_max_timeout = float(conf.get("changes_max_timeout", 30))
+        self.changes_poll_interval = float(conf.get("changes_poll_interval", 0.5))
+        self.bulk_info_max_containers = int(conf.get("bulk_info_max_containers", 1000))
+        self.bulk_info_concurrency = int(conf.get("bulk_info_concurrency", 4))
+        self.bulk_info_broker_pool_size = int(
+            conf.get("bulk_info_broker_pool_size", 1000)
+        )
+        #: maps db path -> (broker, inode of its db file) for the brokers kept
+        #: open for INFO requests, least recently used first
+        self._broker_pool = collections.OrderedDict()
+        self.update_batch_size = int(conf.get("update_batch_size", 1000))
+        self.replicate_batch_size = int(conf.get("replicate_batch_size", 1000))
+        self.replicate_encodings = ["identity", "deflate", "gzip"]
+        if zstandard:
+            self.replicate_encodings.append("zstd")
+        self.db_exists_cache_ttl = float(conf.get("db_exists_cache_ttl", 0))
+        self.db_missing_cache_ttl = float(conf.get("db_missing_cache_ttl", 0))
+        #: maps db dir -> (expiry time, whether a db file exists in the dir)
+        self._db_exists_cache = {}
+        #: maps drive -> device path, for drives last found to be valid
+        self._valid_drives = {}
+        self._drive_checker = None
+        self.phase_timing_sample_rate = float(conf.get("phase_timing_sample_rate", 0))
+        #: holds the PhaseTimer, if any, and the profiled broker, if any, of
+        #: the request being handled
+        self._request_local = threading.local()
+        profile_sample_every = int(conf.get("profile_sample_every", 0))
+        if profile_sample_every > 0:
+            self.profiler = RequestProfiler(
+                profile_sample_every,
+                profile_dir=conf.get("profile_dir") or None,
+                dump_interval=float(conf.get("profile_dump_interval", 60)),
+                logger=self.logger,
+            )
+        else:
+            self.profiler = None
 
+    @timed_phase("broker_open")
     def _get_container_broker(self, drive, part, account, container, **kwargs):
         """
         Get a DB broker for the container.
@@ -237,7 +714,46 @@ class ContainerController(BaseStorageServer):
         kwargs.setdefault("account", account)
         kwargs.setdefault("container", container)
         kwargs.setdefault("logger", self.logger)
-        return ContainerBroker(db_path, **kwargs)
+        for key, value in self.broker_options.items():
+            kwargs.setdefault(key, value)
+        broker = ContainerBroker(db_path, **kwargs)
+        broker.phase_timer = getattr(self._request_local, "phase_timer", None)
+        if getattr(self._request_local, "profiling", False):
+            self._request_local.profiled_broker = broker
+        return broker
+
+    @timed_phase("broker_open")
+    def db_exists(self, broker):
+        """
+        Check whether the broker's db file exists.
+
+        If ``db_exists_cache_ttl`` or ``db_missing_cache_ttl`` is set then the
+        result of the check is remembered for that long for the broker's db
+        dir, so that repeated requests for the same container can skip
+        listing and stat'ing the db dir.
+
+        :param broker: a ContainerBroker
+        :returns: True if the db file exists, False otherwise
+        """
+        cached = self._db_exists_cache.get(broker.db_dir)
+        if cached and cached[0] > time.time():
+            return cached[1]
+        exists = os.path.exists(broker.db_file)
+        ttl = self.db_exists_cache_ttl if exists else self.db_missing_cache_ttl
+        if ttl > 0:
+            if len(self._db_exists_cache) >= DB_EXISTS_CACHE_SIZE:
+                self._db_exists_cache.clear()
+            self._db_exists_cache[broker.db_dir] = (time.time() + ttl, exists)
+        return exists
+
+    def forget_db_exists(self, db_dir):
+        """
+        Discard any cached :meth:`db_exists` result for a db dir; this must be
+        called whenever a db file may have been created or removed.
+
+        :param db_dir: the db dir
+        """
+        self._db_exists_cache.pop(db_dir, None)
 
     def get_and_validate_policy_index(self, req):
         """
@@ -265,6 +781,7 @@ class ContainerController(BaseStorageServer):
         else:
             return int(policy)
 
+    @timed_phase("account_update")
     def account_update(self, req, account, container, broker):
         """
         Update the account server(s) with latest container info.
@@ -427,11 +944,83 @@ class ContainerController(BaseStorageServer):
         req.environ["swift.leave_relative_location"] = True
         return HTTPMovedPermanently(headers=headers, request=req)
 
-    def check_free_space(self, drive):
-        drive_root = os.path.join(self.root, drive)
-        return fs_has_free_space(
-            drive_root, self.fallocate_reserve, self.fallocate_is_percent
-        )
+    def check_free_space(self, drive, bytes_needed=0):
+        """
+        Check whether a drive has more free space than the fallocate reserve,
+        with :func:`~swift.common.utils.fs_has_free_space`.
+
+        Once a drive has passed the check, it is not checked again for up to
+        ``free_space_check_interval`` seconds, during which requests may
+        write up to ``free_space_check_bytes`` between them; a drive that has
+        failed the check is checked again by every request.
+
+        :param drive: the drive name
+        :param bytes_needed: the number of bytes the request may write
+        :returns: True if the drive has enough free space, False otherwise
+        """
+        now = time.time()
+        cached = self._free_space_cache.get(drive)
+        if cached and now - cached[0] < self.free_space_check_interval:
+            cached[1] -= bytes_needed
+            if cached[1] >= 0:
+                return True
+        if not fs_has_free_space(
+            os.path.join(self.root, drive),
+            self.fallocate_reserve,
+            self.fallocate_is_percent,
+        ):
+            self._free_space_cache.pop(drive, None)
+            return False
+        self._free_space_cache[drive] = [
+            now,
+            self.free_space_check_bytes - bytes_needed,
+        ]
+        return True
+
+    @timed_phase("drive_check")
+    def check_drive(self, drive):
+        """
+        Validate a drive, as for :func:`~swift.common.constraints.check_drive`.
+
+        If ``drive_check_interval`` is set then valid drives are remembered,
+        and requests for them skip the check; a background greenthread
+        re-checks each remembered drive every ``drive_check_interval`` seconds
+        and forgets those that are no longer valid. Invalid drives are checked
+        on every request.
+
+        :param drive: the drive name
+        :returns: full path to the device
+        :raises ValueError: if the drive fails to validate
+        """
+        path = self._valid_drives.get(drive)
+        if path:
+            return path
+        path = check_drive(self.root, drive, self.mount_check)
+        if self.drive_check_interval > 0:
+            self._valid_drives[drive] = path
+            if self._drive_checker is None:
+                self._drive_checker = spawn(self._check_valid_drives)
+        return path
+
+    def _check_valid_drives(self):
+        """
+        Re-check the remembered valid drives forever, emitting each drive's
+        status as a ``drive.<drive>.valid`` or ``drive.<drive>.invalid``
+        metric.
+        """
+        while True:
+            sleep(self.drive_check_interval)
+            for drive in list(self._valid_drives):
+                try:
+                    check_drive(self.root, drive, self.mount_check)
+                except ValueError as err:
+                    self._valid_drives.pop(drive, None)
+                    self.logger.warning("Drive check failed: %s", err)
+                    self.logger.increment("drive.%s.invalid" % drive)
+                except Exception:
+                    self.logger.exception("Error checking drive %s", drive)
+                else:
+                    self.logger.increment("drive.%s.valid" % drive)
 
     @public
     @timing_stats()
@@ -440,7 +1029,7 @@ class ContainerController(BaseStorageServer):
         drive, part, account, container, obj = get_obj_name_and_placement(req)
         req_timestamp = valid_timestamp(req)
         try:
-            check_drive(self.root, drive, self.mount_check)
+            self.check_drive(drive)
         except ValueError:
             return HTTPInsufficientStorage(drive=drive, request=req)
         # policy index is only relevant for delete_obj (and transitively for
@@ -451,7 +1040,7 @@ class ContainerController(BaseStorageServer):
             self._maybe_autocreate(
                 broker, req_timestamp, account, obj_policy_index, req
             )
-        elif not os.path.exists(broker.db_file):
+        elif not self.db_exists(broker):
             return HTTPNotFound()
 
         if obj:  # delete object
@@ -461,6 +1050,7 @@ class ContainerController(BaseStorageServer):
                 return redirect
 
             broker.delete_object(obj, req.headers.get("x-timestamp"), obj_policy_index)
+            self._count_merged_rows(1)
             return HTTPNoContent(request=req)
         else:
             # delete container
@@ -471,6 +1061,7 @@ class ContainerController(BaseStorageServer):
                 and not broker.is_deleted()
             )
             broker.delete_db(req_timestamp.internal)
+            self.forget_db_exists(broker.db_dir)
             if not broker.is_deleted():
                 return HTTPConflict(request=req)
             self._update_sync_store(broker, "DELETE")
@@ -497,7 +1088,8 @@ class ContainerController(BaseStorageServer):
 
         :returns: created, a bool, if database did not previously exist
         """
-        if not os.path.exists(broker.db_file):
+        if not self.db_exists(broker):
+            self.forget_db_exists(broker.db_dir)
             try:
                 broker.initialize(timestamp, new_container_policy)
             except DatabaseAlreadyExists:
@@ -541,18 +1133,19 @@ class ContainerController(BaseStorageServer):
     def _maybe_autocreate(self, broker, req_timestamp, account, policy_index, req):
         created = False
         should_autocreate = self._should_autocreate(account, req)
-        if should_autocreate and not os.path.exists(broker.db_file):
+        if should_autocreate and not self.db_exists(broker):
             if policy_index is None:
                 raise HTTPBadRequest(
                     "X-Backend-Storage-Policy-Index header is required"
                 )
+            self.forget_db_exists(broker.db_dir)
             try:
                 broker.initialize(req_timestamp.internal, policy_index)
             except DatabaseAlreadyExists:
                 pass
             else:
                 created = True
-        if not os.path.exists(broker.db_file):
+        if not self.db_exists(broker):
             raise HTTPNotFound()
         return created
 
@@ -588,10 +1181,10 @@ class ContainerController(BaseStorageServer):
             if err:
                 return HTTPBadRequest(err)
         try:
-            check_drive(self.root, drive, self.mount_check)
+            self.check_drive(drive)
         except ValueError:
             return HTTPInsufficientStorage(drive=drive, request=req)
-        if not self.check_free_space(drive):
+        if not self.check_free_space(drive, req.content_length or 0):
             return HTTPInsufficientStorage(drive=drive, request=req)
         requested_policy_index = self.get_and_validate_policy_index(req)
         broker = self._get_container_broker(drive, part, account, container)
@@ -618,6 +1211,7 @@ class ContainerController(BaseStorageServer):
                 wsgi_to_str(req.headers.get("x-content-type-timestamp")),
                 wsgi_to_str(req.headers.get("x-meta-timestamp")),
             )
+            self._count_merged_rows(1)
             return HTTPCreated(request=req)
 
         record_type = req.headers.get("x-backend-record-type", "").lower()
@@ -672,13 +1266,16 @@ class ContainerController(BaseStorageServer):
         drive, part, account, container, obj = get_obj_name_and_placement(req)
         out_content_type = listing_formats.get_listing_content_type(req)
         try:
-            check_drive(self.root, drive, self.mount_check)
+            self.check_drive(drive)
         except ValueError:
             return HTTPInsufficientStorage(drive=drive, request=req)
         broker = self._get_container_broker(
             drive, part, account, container, pending_timeout=0.1, stale_reads_ok=True
         )
-        info, is_deleted = broker.get_info_is_deleted()
+        if self.db_exists(broker):
+            info, is_deleted = broker.get_info_is_deleted()
+        else:
+            info, is_deleted = {}, True
         headers = gen_resp_headers(info, is_deleted=is_deleted)
         if is_deleted:
             return HTTPNotFound(request=req, headers=headers)
@@ -722,7 +1319,7 @@ class ContainerController(BaseStorageServer):
                 "content_type": content_type,
             }
             override_bytes_from_content_type(response, logger=self.logger)
-        response["last_modified"] = Timestamp(created).isoformat
+        response["last_modified"] = timestamps.isoformat(created)
         return response
 
     @public
@@ -797,6 +1394,16 @@ class ContainerController(BaseStorageServer):
           uncovered tail of the requested name range and will point back to the
           same container.
 
+        * If the ``changes_feed`` option is enabled, a ``changes`` query string
+          parameter requests the container's changes feed instead of an object
+          listing; see :meth:`_changes_feed`.
+
+        * If the ``prefix_stats`` option is enabled, a ``stats`` query string
+          parameter with a value in :attr:`swift.common.utils.TRUE_VALUES`
+          requests, as JSON, the ``object_count`` and ``bytes_used`` of the
+          objects whose names start with any ``prefix`` value instead of an
+          object listing.
+
         * Listings are not normally returned from a deleted container. However,
           the ``X-Backend-Override-Deleted`` header may be used with a value in
           :attr:`swift.common.utils.TRUE_VALUES` to force a shard range
@@ -817,13 +1424,16 @@ class ContainerController(BaseStorageServer):
         reverse = config_true_value(params.get("reverse"))
         out_content_type = listing_formats.get_listing_content_type(req)
         try:
-            check_drive(self.root, drive, self.mount_check)
+            self.check_drive(drive)
         except ValueError:
             return HTTPInsufficientStorage(drive=drive, request=req)
         broker = self._get_container_broker(
             drive, part, account, container, pending_timeout=0.1, stale_reads_ok=True
         )
-        info, is_deleted = broker.get_info_is_deleted()
+        if self.db_exists(broker):
+            info, is_deleted = broker.get_info_is_deleted()
+        else:
+            info, is_deleted = {}, True
         record_type = req.headers.get("x-backend-record-type", "").lower()
         db_state = info.get("db_state")
         if record_type == "auto" and db_state in (SHARDING, SHARDED):
@@ -879,6 +1489,8 @@ class ContainerController(BaseStorageServer):
             resp_headers = gen_resp_headers(info, is_deleted=is_deleted)
             if is_deleted:
                 return HTTPNotFound(request=req, headers=resp_headers)
+            if self.changes_feed and "changes" in req.params:
+                return self._changes_feed(req, broker, info, resp_headers, limit)
             resp_headers["X-Backend-Record-Type"] = "object"
             storage_policy_index = (
                 requested_policy_index
@@ -886,10 +1498,38 @@ class ContainerController(BaseStorageServer):
                 else info["storage_policy_index"]
             )
             resp_headers["X-Backend-Record-Storage-Policy-Index"] = storage_policy_index
-            # Use the retired db while container is in process of sharding,
-            # otherwise use current db
-            src_broker = broker.get_brokers()[0]
-            container_list = src_broker.list_objects_iter(
+            if self.prefix_stats and config_true_value(get_param(req, "stats")):
+                prefix_stats = broker.get_brokers()[0].get_prefix_stats(
+                    prefix or "",
+                    delimiter=delimiter or "/",
+                    storage_policy_index=storage_policy_index,
+                )
+                prefix_stats["prefix"] = prefix or ""
+                return Response(
+                    request=req,
+                    headers=resp_headers,
+                    body=json.dumps(prefix_stats).encode("ascii"),
+                    content_type="application/json",
+                    charset="utf-8",
+                )
+            if self.merged_sharding_listings:
+                # while the container is sharding, merge the retiring and
+                # fresh dbs' rows
+                list_objects_iter = broker.list_merged_objects_iter
+            else:
+                # Use the retired db while container is in process of
+                # sharding, otherwise use current db
+                list_objects_iter = broker.get_brokers()[0].list_objects_iter
+            if self.tpool_listings:
+                # run the listing query in a thread, so that it does not
+                # block other requests, limited by the drive's executor; the
+                # pending updates are committed here first, as merging them
+                # uses the drive's executor too
+                broker.commit_pending()
+                list_objects_iter = functools.partial(
+                    broker.tpool_execute, list_objects_iter
+                )
+            container_list = list_objects_iter(
                 limit,
                 marker,
                 end_marker,
@@ -910,6 +1550,99 @@ class ContainerController(BaseStorageServer):
             container,
         )
 
+    def _changes_feed(self, req, broker, info, resp_headers, limit):
+        """
+        Respond to a GET request for a container's changes feed.
+
+        The response body lists, as ``application/x-ndjson``, up to ``limit``
+        object rows, including deleted rows, in all policies, whose ROWID is
+        greater than that of the ``changes`` cursor, in ROWID order. Each row
+        is a dict with the keys in :data:`CHANGES_KEYS`. An object appears
+        again each time it is updated.
+
+        If there are no such rows the request waits for up to ``timeout``
+        seconds, capped by the ``changes_max_timeout`` option, for rows to be
+        committed; if none are, the response is a 204.
+
+        The ``X-Container-Changes-Cursor`` response header is the cursor to
+        send with the next request. An empty ``changes`` value starts from
+        the first row. ROWIDs are only meaningful for one db, so a cursor
+        names the db it belongs to; if that is not the container's current
+        db, for example because the db was replaced by replication or
+        sharding, the feed starts again from the first row and the
+        ``X-Container-Changes-Reset`` response header is set.
+
+        The feed is incomplete while a container is sharding: it only lists
+        the rows of the fresh db, not those of the retiring db, and objects
+        that are moved to shard containers do not appear in it.
+
+        The rows are read in one read transaction, which blocks commits to
+        the db, so they are all read before the response starts rather than
+        while it is sent; their encoding is streamed.
+
+        :param req: an instance of :class:`swift.common.swob.Request`
+        :param broker: the container's broker
+        :param info: the container's info
+        :param resp_headers: the response headers
+        :param limit: the most rows to return
+        :returns: an instance of :class:`swift.common.swob.Response`
+        """
+        cursor = get_param(req, "changes") or ""
+        db_id = info["id"]
+        since_row = 0
+        if cursor:
+            cursor_db_id, _junk, cursor_row = cursor.rpartition(":")
+            try:
+                cursor_row = int(cursor_row)
+            except ValueError:
+                return HTTPBadRequest(request=req, body="Invalid changes cursor")
+            if cursor_db_id == db_id:
+                since_row = cursor_row
+            else:
+                resp_headers["X-Container-Changes-Reset"] = "true"
+        try:
+            timeout = float(get_param(req, "timeout") or 0)
+            if math.isnan(timeout) or math.isinf(timeout):
+                raise ValueError("timeout is not finite")
+        except ValueError:
+            return HTTPBadRequest(request=req, body="Invalid timeout")
+        deadline = time.time() + min(max(timeout, 0), self.changes_max_timeout)
+        while True:
+            # exporting also commits any pending updates to the db
+            rows = list(broker.export_objects(since_row=since_row, limit=limit))
+            remaining = deadline - time.time()
+            if rows or remaining <= 0:
+                break
+            sleep(min(self.changes_poll_interval, remaining))
+        if rows:
+            since_row = rows[-1][-1]
+        resp_headers["X-Backend-Record-Type"] = "object"
+        resp_headers["X-Container-Changes-Cursor"] = "%s:%d" % (db_id, since_row)
+        if not rows:
+            return Response(
+                request=req,
+                headers=resp_headers,
+                content_type="application/x-ndjson",
+                charset="utf-8",
+                status=HTTP_NO_CONTENT,
+            )
+
+        def iter_body():
+            for start in range(0, len(rows), CHANGES_CHUNK_ROWS):
+                yield "".join(
+                    json.dumps(dict(zip(CHANGES_KEYS, row))) + "\n"
+                    for row in rows[start : start + CHANGES_CHUNK_ROWS]
+                ).encode("ascii")
+
+        return Response(
+            request=req,
+            headers=resp_headers,
+            app_iter=iter_body(),
+            content_type="application/x-ndjson",
+            charset="utf-8",
+        )
+
+    @timed_phase("serialize")
     def create_listing(
         self,
         req,
@@ -956,19 +1689,94 @@ class ContainerController(BaseStorageServer):
         post_args = split_and_validate_path(req, 3)
         drive, partition, hash = post_args
         try:
-            check_drive(self.root, drive, self.mount_check)
+            self.check_drive(drive)
         except ValueError:
             return HTTPInsufficientStorage(drive=drive, request=req)
-        if not self.check_free_space(drive):
+        if not self.check_free_space(drive, req.content_length or 0):
             return HTTPInsufficientStorage(drive=drive, request=req)
+        # let the sender know which encodings it may use
+        accept_encoding = ", ".join(self.replicate_encodings)
+        content_encoding = req.headers.get("Content-Encoding", "identity").lower()
+        wsgi_input = req.environ["wsgi.input"]
+        if content_encoding in ("deflate", "gzip"):
+            wsgi_input = DecompressingReader(wsgi_input)
+        elif content_encoding == "zstd" and zstandard:
+            wsgi_input = zstandard.ZstdDecompressor().stream_reader(wsgi_input)
+        elif content_encoding != "identity":
+            return HTTPBadRequest(
+                body="Unsupported Content-Encoding: %s" % content_encoding,
+                content_type="text/plain",
+                headers={"X-Backend-Accept-Encoding": accept_encoding},
+                request=req,
+            )
         try:
-            args = json.load(req.environ["wsgi.input"])
-        except ValueError as err:
-            return HTTPBadRequest(body=str(err), content_type="text/plain")
-        ret = self.replicator_rpc.dispatch(post_args, args)
+            ret = self._replicate(post_args, JSONStreamReader(wsgi_input))
+        except (ValueError, zlib.error) as err:
+            ret = HTTPBadRequest(body=str(err), content_type="text/plain")
+        self.forget_db_exists(
+            os.path.join(self.root, drive, storage_directory(DATADIR, partition, hash))
+        )
+        ret.headers["X-Backend-Accept-Encoding"] = accept_encoding
         ret.request = req
         return ret
 
+    def _replicate(self, post_args, reader):
+        """
+        Decode a REPLICATE RPC and dispatch it to the replicator RPC.
+
+        The list argument of a :data:`STREAMED_REPLICATE_OPS` RPC is decoded
+        incrementally and dispatched in batches of ``replicate_batch_size``
+        items; the next batch is only read from the request once the previous
+        batch has been merged. Any further arguments, such as the ``source``
+        of ``merge_items``, are dispatched with the last batch.
+
+        :param post_args: a list of (drive, partition, hash)
+        :param reader: a :class:`JSONStreamReader` for the request body
+        :returns: the response from the replicator RPC
+        :raises ValueError: if the request body is not valid JSON
+        """
+        if reader.peek() != "[":
+            # not an RPC; let the replicator RPC reject it
+            args = reader.value()
+            reader.end()
+            return self.replicator_rpc.dispatch(post_args, args)
+        reader.start_array()
+        args = []
+        if reader.next_element():
+            args.append(reader.value())
+        if args[:1] and args[0] in STREAMED_REPLICATE_OPS and reader.next_element():
+            op = args[0]
+            batch = []
+            reader.start_array()
+            while reader.next_element():
+                item = reader.value()
+                if len(batch) >= self.replicate_batch_size:
+                    batch_args = [op, batch]
+                    if op == "merge_items":
+                        batch_args.append(None)  # no source until the end
+                    ret = self.replicator_rpc.dispatch(post_args, batch_args)
+                    if not is_success(ret.status_int):
+                        return ret
+                    if op == "merge_items":
+                        self._count_merged_rows(len(batch))
+                    batch = []
+                batch.append(item)
+            args.append(batch)
+        while reader.next_element():
+            args.append(reader.value())
+        reader.end()
+        # the replicator RPC pops the op from the args it is given
+        op = args[0] if args else None
+        items = args[1] if len(args) > 1 else None
+        ret = self.replicator_rpc.dispatch(post_args, args)
+        if (
+            op == "merge_items"
+            and isinstance(items, list)
+            and is_success(ret.status_int)
+        ):
+            self._count_merged_rows(len(items))
+        return ret
+
     @public
     @timing_stats()
     def UPDATE(self, req):
@@ -978,10 +1786,10 @@ class ContainerController(BaseStorageServer):
         drive, part, account, container = get_container_name_and_placement(req)
         req_timestamp = valid_timestamp(req)
         try:
-            check_drive(self.root, drive, self.mount_check)
+            self.check_drive(drive)
         except ValueError:
             return HTTPInsufficientStorage(drive=drive, request=req)
-        if not self.check_free_space(drive):
+        if not self.check_free_space(drive, req.content_length or 0):
             return HTTPInsufficientStorage(drive=drive, request=req)
 
         requested_policy_index = self.get_and_validate_policy_index(req)
@@ -989,13 +1797,247 @@ class ContainerController(BaseStorageServer):
         self._maybe_autocreate(
             broker, req_timestamp, account, requested_policy_index, req
         )
+        # records are merged in batches as the body is decoded, so records
+        # before any badly formed part of the body will have been merged
+        batch = []
         try:
-            objs = json.load(req.environ["wsgi.input"])
+            for record in self._iter_update_records(req):
+                batch.append(record)
+                if len(batch) >= self.update_batch_size:
+                    broker.merge_items(batch)
+                    self._count_merged_rows(len(batch))
+                    batch = []
         except ValueError as err:
             return HTTPBadRequest(body=str(err), content_type="text/plain")
-        broker.merge_items(objs)
+        if batch:
+            broker.merge_items(batch)
+            self._count_merged_rows(len(batch))
         return HTTPAccepted(request=req)
 
+    def _iter_update_records(self, req):
+        """
+        Yields the object records in the body of an UPDATE request, as dicts.
+
+        The body may be a JSON array, or, if the request's Content-Type is
+        ``application/x-ndjson`` or ``application/msgpack``, a stream of
+        newline-delimited JSON values or msgpack values; the stream is decoded
+        as it is read. Each record is either a dict or an array of values for
+        the keys in :data:`UPDATE_RECORD_KEYS`.
+
+        :param req: the swob request object
+        :raises ValueError: if the body cannot be decoded or holds an invalid
+            record
+        """
+        required_keys = UPDATE_RECORD_KEYS[:UPDATE_RECORD_REQUIRED_KEYS]
+        for record in self._decode_update_records(req):
+            if isinstance(record, list):
+                if not (
+                    UPDATE_RECORD_REQUIRED_KEYS
+                    <= len(record)
+                    <= len(UPDATE_RECORD_KEYS)
+                ):
+                    raise ValueError(
+                        "Object record arrays must have %d to %d values"
+                        % (UPDATE_RECORD_REQUIRED_KEYS, len(UPDATE_RECORD_KEYS))
+                    )
+                record = dict(zip(UPDATE_RECORD_KEYS, record))
+            elif not isinstance(record, dict):
+                raise ValueError("Object records must be objects or arrays")
+            missing = [key for key in required_keys if key not in record]
+            if missing:
+                raise ValueError("Object record missing %s" % ", ".join(missing))
+            if not isinstance(record["name"], six.string_types):
+                raise ValueError("Object record name must be a string")
+            yield record
+
+    def _decode_update_records(self, req):
+        """
+        Yields the values decoded from the body of an UPDATE request; see
+        :meth:`_iter_update_records`.
+        """
+        wsgi_input = req.environ["wsgi.input"]
+        content_type = req.headers.get("Content-Type", "").split(";")[0]
+        content_type = content_type.strip().lower()
+        if content_type == "application/x-ndjson":
+            while True:
+                line = wsgi_input.readline(MAX_UPDATE_LINE_LENGTH)
+                if not line:
+                    break
+                if len(line) >= MAX_UPDATE_LINE_LENGTH and not line.endswith(b"\n"):
+                    raise ValueError(
+                        "Line longer than %d bytes" % MAX_UPDATE_LINE_LENGTH
+                    )
+                if line.strip():
+                    yield json.loads(line)
+        elif content_type == "application/msgpack":
+            if msgpack is None:
+                raise ValueError("msgpack is not installed")
+            unpacker = msgpack.Unpacker(raw=False)
+            bytes_read = bytes_decoded = 0
+            while True:
+                chunk = wsgi_input.read(65536)
+                if not chunk:
+                    break
+                bytes_read += len(chunk)
+                unpacker.feed(chunk)
+                for record in unpacker:
+                    bytes_decoded = unpacker.tell()
+                    yield record
+            if bytes_decoded != bytes_read:
+                raise ValueError("Truncated msgpack body")
+        else:
+            for record in json.load(wsgi_input):
+                yield record
+
+    @public
+    @timing_stats()
+    def INFO(self, req):
+        """
+        Handle HTTP INFO request (the info of many containers on a drive.)
+
+        The request body is a JSON array of ``[account, container]`` or
+        ``[account, container, partition]`` items; the partition defaults to
+        the partition in the request path. The response body is a JSON array
+        with, for each item in the same order, a dict with the item's
+        ``account`` and ``container``, the ``status`` that a HEAD of the
+        container would have and the ``headers`` that it would return.
+
+        Containers are looked up concurrently, using brokers that are kept
+        open between requests.
+        """
+        drive, part, account, container = split_and_validate_path(req, 2, 4)
+        try:
+            self.check_drive(drive)
+        except ValueError:
+            return HTTPInsufficientStorage(drive=drive, request=req)
+        if account or container:
+            return HTTPBadRequest(request=req, body="Unexpected account or container")
+        max_body_size = self.bulk_info_max_containers * 2048
+        if (req.content_length or 0) > max_body_size:
+            return HTTPRequestEntityTooLarge(request=req)
+        # a chunked body has no content length, so read no more than is allowed
+        body = req.environ["wsgi.input"].read(max_body_size + 1)
+        if len(body) > max_body_size:
+            return HTTPRequestEntityTooLarge(request=req)
+        try:
+            items = json.loads(body)
+            if not isinstance(items, list):
+                raise ValueError("Expected a list")
+            if len(items) > self.bulk_info_max_containers:
+                return HTTPRequestEntityTooLarge(request=req)
+            containers = []
+            for item in items:
+                if (
+                    not isinstance(item, list)
+                    or not 2 <= len(item) <= 3
+                    or not all(isinstance(name, six.string_types) for name in item[:2])
+                ):
+                    raise ValueError("Invalid item: %r" % (item,))
+                item_part = str(int(item[2])) if len(item) == 3 else part
+                containers.append((item[0], item[1], item_part))
+        except (ValueError, TypeError) as err:
+            return HTTPBadRequest(request=req, body=str(err))
+        pile = GreenPile(max(self.bulk_info_concurrency, 1))
+        for account, container, item_part in containers:
+            pile.spawn(self._container_info, drive, item_part, account, container)
+        return Response(
+            request=req,
+            body=json.dumps(list(pile)).encode("ascii"),
+            content_type="application/json",
+            charset="utf-8",
+        )
+
+    def _container_info(self, drive, part, account, container):
+        """
+        Get the status and headers of a HEAD of a container, for an INFO
+        request.
+        """
+        result = {"account": account, "container": container}
+        pooled = self._get_pooled_broker(drive, part, account, container)
+        try:
+            if pooled:
+                pooled[1].commit_pending()
+                info, is_deleted, metadata = pooled[1].tpool_execute(
+                    self._get_info_and_metadata, pooled[1]
+                )
+            else:
+                info, is_deleted, metadata = {}, True, {}
+        except ExecutorQueueFull:
+            result.update(status=503, headers={})
+            return result
+        except Exception:
+            self.logger.exception("ERROR getting info of %s/%s", account, container)
+            result.update(status=500, headers={})
+            return result
+        if pooled:
+            self._put_pooled_broker(*pooled)
+        headers = gen_resp_headers(info, is_deleted=is_deleted)
+        if not is_deleted:
+            headers.update(
+                (str_to_wsgi(key), str_to_wsgi(value))
+                for key, (value, timestamp) in metadata.items()
+                if value != ""
+                and (
+                    key.lower() in self.save_headers
+                    or is_sys_or_user_meta("container", key)
+                )
+            )
+        result.update(status=404 if is_deleted else 204, headers=headers)
+        return result
+
+    def _get_info_and_metadata(self, broker):
+        info, is_deleted = broker.get_info_is_deleted()
+        return info, is_deleted, broker.metadata
+
+    def _get_pooled_broker(self, drive, part, account, container):
+        """
+        Take a broker for a container from the pool of open brokers, or get a
+        new broker if the pool has none for the container.
+
+        A pooled broker is reloaded if the container's db files have changed,
+        for example because the container has started sharding or its db has
+        been replaced by replication.
+
+        :returns: a tuple of (db path, broker, inode of its db file) that
+            may be returned to the pool with :meth:`_put_pooled_broker`, or
+            None if the container has no db
+        """
+        hsh = hash_path(account, container)
+        db_dir = storage_directory(DATADIR, part, hsh)
+        db_path = os.path.join(self.root, drive, db_dir, hsh + ".db")
+        broker, inode = self._broker_pool.pop(db_path, (None, None))
+        if broker is None:
+            broker = self._get_container_broker(
+                drive,
+                part,
+                account,
+                container,
+                pending_timeout=0.1,
+                stale_reads_ok=True,
+            )
+        elif get_db_files(db_path) != broker.db_files:
+            broker.reload_db_files()
+        try:
+            db_inode = os.stat(broker.db_file).st_ino
+        except OSError:
+            return None
+        if inode is not None and db_inode != inode:
+            broker.reload_db_files()
+        return db_path, broker, db_inode
+
+    def _put_pooled_broker(self, db_path, broker, inode):
+        """
+        Return a broker taken by :meth:`_get_pooled_broker` to the pool,
+        closing the connections of the least recently used brokers if the
+        pool is full.
+        """
+        self._broker_pool[db_path] = (broker, inode)
+        while len(self._broker_pool) > self.bulk_info_broker_pool_size:
+            _db_path, (broker, _inode) = self._broker_pool.popitem(last=False)
+            if broker.conn:
+                broker.conn.close()
+                broker.conn = None
+
     @public
     @timing_stats()
     def POST(self, req):
@@ -1011,10 +2053,10 @@ class ContainerController(BaseStorageServer):
             if err:
                 return HTTPBadRequest(err)
         try:
-            check_drive(self.root, drive, self.mount_check)
+            self.check_drive(drive)
         except ValueError:
             return HTTPInsufficientStorage(drive=drive, request=req)
-        if not self.check_free_space(drive):
+        if not self.check_free_space(drive, req.content_length or 0):
             return HTTPInsufficientStorage(drive=drive, request=req)
         broker = self._get_container_broker(drive, part, account, container)
         if broker.is_deleted():
@@ -1027,40 +2069,216 @@ class ContainerController(BaseStorageServer):
         start_time = time.time()
         req = Request(env)
         self.logger.txn_id = req.headers.get("x-trans-id", None)
+        timer = None
+        if (
+            self.phase_timing_sample_rate > 0
+            and random.random() < self.phase_timing_sample_rate
+        ):
+            timer = self._request_local.phase_timer = PhaseTimer()
+        profile = None
+        request_class = self._request_class(req) if self.scheduler else None
+        if self.hot_containers:
+            self._request_local.rows_merged = 0
         if not check_utf8(wsgi_to_str(req.path_info), internal=True):
             res = HTTPPreconditionFailed(body="Invalid UTF8 or contains NULL")
+        elif req.method not in self.allowed_methods:
+            # disallow methods which have not been marked 'public'
+            res = HTTPMethodNotAllowed()
+        elif req.path_info in RECON_PATHS:
+            res = self._recon(req)
+        elif request_class and not self.scheduler.acquire(request_class):
+            self.logger.increment("scheduler.%s.shed" % request_class)
+            res = HTTPServiceUnavailable(
+                body="Too many %s requests" % request_class,
+                headers={"Retry-After": str(self.scheduler.retry_after)},
+            )
         else:
             try:
-                # disallow methods which have not been marked 'public'
-                if req.method not in self.allowed_methods:
-                    res = HTTPMethodNotAllowed()
-                else:
-                    res = getattr(self, req.method)(req)
+                if (
+                    self.profiler
+                    and req.method in PROFILED_METHODS
+                    and self.profiler.should_profile()
+                ):
+                    profile = self.profiler.start()
+                    self._request_local.profiling = True
+                    self._request_local.profiled_broker = None
+                res = getattr(self, req.method)(req)
             except HTTPException as error_response:
                 res = error_response
+            except ExecutorQueueFull as err:
+                res = HTTPServiceUnavailable(
+                    body=str(err),
+                    headers={"Retry-After": str(self.tpool_retry_after)},
+                )
             except (Exception, Timeout):
                 self.logger.exception(
                     "ERROR __call__ error with %(method)s %(path)s ",
                     {"method": req.method, "path": req.path},
                 )
                 res = HTTPInternalServerError(body=traceback.format_exc())
-        if self.log_requests:
+            finally:
+                if request_class:
+                    self.scheduler.release(request_class)
+            if profile:
+                self._finish_profile(req, profile)
+            if self.hot_containers:
+                self._record_hot_container(req)
+        if timer:
+            self._request_local.phase_timer = None
+            with timer.phase("response_write"):
+                app_iter = res(env, start_response)
             trans_time = time.time() - start_time
-            log_message = get_log_line(
-                req,
-                res,
-                trans_time,
-                "",
-                self.log_format,
-                self.anonymization_method,
-                self.anonymization_salt,
-            )
-            if req.method.upper() == "REPLICATE":
-                self.logger.debug(log_message)
-            else:
-                self.logger.info(log_message)
+
+            def finish_request():
+                # the phases, and the access log line that includes them, are
+                # only complete once the response body has been sent
+                self._log_request(
+                    req, res, trans_time, self._emit_phase_timings(req, timer)
+                )
+
+            return PhaseTimedIter(app_iter, timer, "response_write", finish_request)
+        self._log_request(req, res, time.time() - start_time, "")
         return res(env, start_response)
 
+    def _log_request(self, req, res, trans_time, additional_info):
+        """
+        Write a request's access log line, if requests are logged.
+        """
+        if not self.log_requests:
+            return
+        log_message = get_log_line(
+            req,
+            res,
+            trans_time,
+            additional_info,
+            self.log_format,
+            self.anonymization_method,
+            self.anonymization_salt,
+        )
+        if req.method.upper() == "REPLICATE":
+            self.logger.debug(log_message)
+        else:
+            self.logger.info(log_message)
+
+    def _count_merged_rows(self, count):
+        """
+        Count rows merged into the db of the container of the request being
+        handled, if hot containers are tracked.
+        """
+        if self.hot_containers:
+            self._request_local.rows_merged = (
+                getattr(self._request_local, "rows_merged", 0) + count
+            )
+
+    def _record_hot_container(self, req):
+        """
+        Count a handled request, and the rows that it merged, against its
+        container.
+        """
+        try:
+            drive, part, account, container, obj = split_path(
+                wsgi_to_str(req.path_info), 3, 5, True
+            )
+        except ValueError:
+            return
+        if req.method == "REPLICATE":
+            # the path of a REPLICATE request names the db's hash
+            key, name = account, None
+        elif container:
+            key, name = hash_path(account, container), "%s/%s" % (account, container)
+        else:
+            return
+        self.hot_containers.record(key, name=name, rows=self._request_local.rows_merged)
+
+    def _request_class(self, req):
+        """
+        Returns the name of the scheduling class of a request, or None if
+        the request is not scheduled.
+
+        :param req: the swob request object
+        """
+        if req.method == "GET":
+            params = req.params
+            if "changes" in params and "timeout" in params:
+                return LONG_POLL_CLASS
+        return REQUEST_CLASSES.get(req.method)
+
+    def _recon(self, req):
+        """
+        Serve the JSON stats of one of the optional request handling
+        features. Recon requests are neither scheduled nor profiled, so that
+        the stats stay readable when the server is overloaded.
+
+        :param req: the swob request object
+        :returns: a swob response; 404 if the feature is not enabled
+        """
+        if req.method != "GET":
+            return HTTPMethodNotAllowed(request=req)
+        sources = {
+            PROFILE_RECON_PATH: self.profiler and self.profiler.summary,
+            TPOOL_RECON_PATH: self.drive_executors and self.drive_executors.stats,
+            HOT_CONTAINERS_RECON_PATH: (
+                self.hot_containers and self.hot_containers.summary
+            ),
+            SCHEDULER_RECON_PATH: self.scheduler and self.scheduler.stats,
+        }
+        source = sources[req.path_info]
+        if not source:
+            return HTTPNotFound(request=req)
+        return Response(body=json.dumps(source()), content_type="application/json")
+
+    def _finish_profile(self, req, profile):
+        """
+        Stop profiling a request and aggregate its profile under a tag made
+        of the request method, the container's size bucket and its db state.
+
+        The tag is made from the info the request already fetched, if any, so
+        that finishing the profile does not touch the db.
+
+        :param req: the swob request object
+        :param profile: the profile returned by the profiler's ``start``
+        """
+        self._request_local.profiling = False
+        broker = self._request_local.profiled_broker
+        self._request_local.profiled_broker = None
+        info = broker.last_info if broker is not None else None
+        if info is None:
+            tag = "%s.unknown.unknown" % req.method
+        else:
+            tag = "%s.%s.%s" % (
+                req.method,
+                size_bucket(info["object_count"]),
+                info["db_state"],
+            )
+        try:
+            self.profiler.stop(profile, tag)
+        except Exception:
+            self.logger.exception("Error aggregating the profile of %s", tag)
+
+    def _emit_phase_timings(self, req, timer):
+        """
+        Emit a ``<METHOD>.phase.<phase>.timing`` metric for each phase of a
+        timed request. Time not attributed to any phase is reported as the
+        ``other`` phase. Requests with a method that the server does not
+        handle are reported under the ``OTHER`` method.
+
+        :param req: the swob request object
+        :param timer: the request's PhaseTimer
+        :returns: a string of ``phase:seconds`` pairs, for the access log
+        """
+        phases = dict(timer.phases)
+        phases["other"] = max(time.time() - timer.start - sum(phases.values()), 0)
+        method = req.method if req.method in self.allowed_methods else "OTHER"
+        for name, elapsed in sorted(phases.items()):
+            self.logger.timing(
+                "%s.phase.%s.timing" % (method, name),
+                elapsed * 1000,
+                sample_rate=self.phase_timing_sample_rate,
+            )
+        return ",".join(
+            "%s:%.4f" % (name, elapsed) for name, elapsed in sorted(phases.items())
+        )
+
 
 def app_factory(global_conf, **local_conf):
     """paste.deploy app factory for creating WSGI container server apps"""
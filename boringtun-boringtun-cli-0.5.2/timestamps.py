@@ -0,0 +1,110 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Fast conversions of the timestamps held in container DBs.
+
+The timestamps in container DBs are almost always in the fixed width
+internal format without an offset, for example ``1700000000.12345``. Such a
+timestamp is already its own internal and normal form, compares with another
+such timestamp as a string does, and only its whole seconds need formatting
+to make its isoformat. Other values are converted by
+:class:`~swift.common.utils.Timestamp`, with the results cached.
+"""
+
+import re
+import time
+
+import six
+
+from swift.common.utils import Timestamp
+
+#: matches timestamps in the internal format without an offset
+FIXED_FORMAT = re.compile(r"[0-9]{10}\.[0-9]{5}\Z")
+#: isoformats of timestamps from this many seconds on are made by Timestamp,
+#: whose float arithmetic may then be a microsecond out from the digits
+ISOFORMAT_MAX_SECONDS = "4000000000"
+#: The most values whose conversions are kept by each cache.
+CACHE_SIZE = 10000
+
+_internal_cache = {}
+_normal_cache = {}
+_isoformat_cache = {}
+#: maps whole seconds, as a string of 10 digits, to their isoformat
+_seconds_cache = {}
+
+
+def _is_fixed(value):
+    return (
+        isinstance(value, six.string_types)
+        and len(value) == 16
+        and FIXED_FORMAT.match(value) is not None
+    )
+
+
+def _cached(cache, value, convert):
+    if isinstance(value, Timestamp):
+        return convert(value)
+    result = cache.get(value)
+    if result is None:
+        if len(cache) >= CACHE_SIZE:
+            cache.clear()
+        result = cache[value] = convert(Timestamp(value))
+    return result
+
+
+def internal(value):
+    """
+    Returns ``Timestamp(value).internal``.
+    """
+    if _is_fixed(value):
+        return value
+    return _cached(_internal_cache, value, lambda ts: ts.internal)
+
+
+def normal(value):
+    """
+    Returns ``Timestamp(value).normal``.
+    """
+    if _is_fixed(value):
+        return value
+    return _cached(_normal_cache, value, lambda ts: ts.normal)
+
+
+def isoformat(value):
+    """
+    Returns ``Timestamp(value).isoformat``.
+    """
+    if not _is_fixed(value) or value >= ISOFORMAT_MAX_SECONDS:
+        return _cached(_isoformat_cache, value, lambda ts: ts.isoformat)
+    seconds = value[:10]
+    date = _seconds_cache.get(seconds)
+    if date is None:
+        if len(_seconds_cache) >= CACHE_SIZE:
+            _seconds_cache.clear()
+        date = _seconds_cache[seconds] = time.strftime(
+            "%Y-%m-%dT%H:%M:%S", time.gmtime(int(seconds))
+        )
+    # the five decimal places of the internal format are exact microseconds
+    return "%s.%s0" % (date, value[11:])
+
+
+def is_newer(value, other):
+    """
+    Returns ``Timestamp(value) > Timestamp(other)``.
+    """
+    if _is_fixed(value) and _is_fixed(other):
+        return value > other
+    return Timestamp(value) > Timestamp(other)